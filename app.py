@@ -1,5 +1,6 @@
 import os
 import warnings
+import traceback
 import streamlit as st
 import requests
 
@@ -9,15 +10,18 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 
 # custom functions
-from utils import stream_data, get_context
-from maps_function import get_distance_and_review
-from gpt_functions import check_response, get_preference, generate_recommendations, further_info
+from utils import stream_data, warm_up, off_topic_response, render_message
+from prefetch import cancel_all
+from history import History
+import service
+import tracing
+from gpt_functions import read_turn, set_preference, find_restaurants, generate_recommendations, further_info
 
 st.set_page_config(page_title="Restaurant Assistant")
 
 ### -------- SESSION STATE ---------
 if 'memories' not in st.session_state:
-    st.session_state.memories = []
+    st.session_state.memories = History()
 if 'preference' not in st.session_state:
     st.session_state.preference = None
 if 'location' not in st.session_state:
@@ -43,15 +47,25 @@ warnings.filterwarnings("ignore")
 os.environ['OPENAI_API_KEY'] = st.secrets['OPENAI_API_KEY']
 gmap_api = st.secrets['GOOGLE_API_KEY']
 
+# build the shared vector store and chat model once per process
+warm_up()
+tracing.start_metrics_server()
+
 
 # webapp title
 st.title('London Restaurant AI Assitant')
 
 
 ### ----------- APP -------------
+# Older messages live in the session store and are only read back when asked for
+earlier_count = st.session_state.memories.stored()
+if earlier_count:
+    if st.toggle(f"Show {earlier_count} earlier messages", key='show_earlier'):
+        for memory in st.session_state.memories.earlier():
+            render_message(memory, embeds=False)
+
 for memory in st.session_state.memories:
-    with st.chat_message(memory["role"]):
-        st.write(memory["content"])
+    render_message(memory)
 
 if st.session_state.state == None:
     with st.chat_message("assistant"):
@@ -73,48 +87,68 @@ if user_input := st.chat_input("Say Something"):
     # Display user message in chat message container
     with st.chat_message("user"):
         st.write(user_input)
+else:
+    # Reruns from other widgets, like the earlier messages toggle, must not answer the last message again
+    st.session_state.input = None
 
-if st.session_state.input and (st.session_state.state == 'prepare'):
-    st.session_state.preference = get_preference(user_input)
-
-if st.session_state.input and (st.session_state.state == 'location'):
-    st.session_state.preference = get_preference(st.session_state.preference + f" preferred location: {user_input}")
-    st.session_state.state = 'generate'
-
-if st.session_state.state == 'generate':
-    restaurants_context = get_context(st.session_state.preference)
-    st.session_state.context = get_distance_and_review(st.session_state.location, restaurants_context)
-    if st.session_state.context != False:
-        generate_recommendations(st.session_state.context)
-        st.session_state.input = None
-
-if st.session_state.input and (st.session_state.state == 'continuation'):
-    response = check_response(st.session_state.input)
-
-    if response.lower() == 'other':
-        generate_recommendations(st.session_state.context)
-        st.session_state.input = None
-    if response.lower() == 'preference':
-        answer = "\nPlease specify your new preferences"
-        st.session_state.memories.append({"role": "assistant", "content": answer})
-
-        with st.chat_message("assistant"):
-            st.write_stream(stream_data(answer))
-
-        st.session_state.state = 'prepare'
-        st.session_state.input = None
-        st.session_state.options = 0
-    
-    if response.isdigit():
-        further_info(st.session_state.context, int(response))
-    
-    if response.lower() == 'neither':
-        answer = "\nI'm sorry, I didn't quite understand. Let me know if you'd like to see other options, set new preferences, or get more details about a specific restaurant."
-        st.session_state.memories.append({"role": "assistant", "content": answer})
-
-        with st.chat_message("assistant"):
-            st.write_stream(stream_data(answer))
-
-
-
-
+# Every upstream call made while answering the input is recorded in this turn's trace
+with tracing.turn() as trace:
+    # Upstream work runs on the shared request engine, tell the user when it is saturated
+    try:
+        # One reading of the message gives its intent, preference, location and number
+        if st.session_state.input and (st.session_state.state in ('prepare', 'location')):
+            set_preference(read_turn(st.session_state.input))
+
+        if st.session_state.input and (st.session_state.state == 'continuation'):
+            turn = read_turn(st.session_state.input)
+
+            if turn.intent == 'other':
+                generate_recommendations(st.session_state.context)
+                st.session_state.input = None
+
+            elif turn.intent in ('preference', 'location') and (turn.preference or turn.location):
+                # A new search stated in full ("sushi in Soho instead") runs straight away
+                cancel_all()
+                st.session_state.options = 0
+                set_preference(turn)
+
+            elif turn.intent == 'preference':
+                answer = "\nPlease specify your new preferences"
+                st.session_state.memories.append({"role": "assistant", "content": answer})
+
+                with st.chat_message("assistant"):
+                    st.write_stream(stream_data(answer))
+
+                st.session_state.state = 'prepare'
+                st.session_state.input = None
+                st.session_state.options = 0
+                st.session_state.preference = None
+                st.session_state.location = None
+                cancel_all()
+
+            elif turn.intent == 'number' and turn.number is not None:
+                further_info(st.session_state.context, turn.number)
+
+            else:
+                answer = "\nI'm sorry, I didn't quite understand. Let me know if you'd like to see other options, set new preferences, or get more details about a specific restaurant."
+                st.session_state.memories.append({"role": "assistant", "content": answer})
+
+                with st.chat_message("assistant"):
+                    st.write_stream(stream_data(answer))
+
+        if st.session_state.state == 'generate':
+            cancel_all()
+            st.session_state.context = find_restaurants(st.session_state.preference, st.session_state.location)
+            if st.session_state.context != False:
+                generate_recommendations(st.session_state.context)
+                st.session_state.input = None
+
+    except service.ServiceBusy:
+        off_topic_response('busy')
+    except service.UPSTREAM_ERRORS:
+        # Timeouts and upstream failures get the retry message, anything else is a bug and surfaces
+        traceback.print_exc()
+        off_topic_response('busy')
+
+if tracing.debug_panel_enabled():
+    tracing.render_debug_panel(trace)
@@ -0,0 +1,43 @@
+import random
+
+# London areas users start from, with the coordinates the stand-in geocoder returns
+AREAS = {
+    'Soho': (51.5136, -0.1365),
+    'Shoreditch': (51.5245, -0.0781),
+    'Borough': (51.5055, -0.0910),
+    'Covent Garden': (51.5118, -0.1226),
+    'Islington': (51.5362, -0.1033),
+    'Brixton': (51.4613, -0.1156),
+    'Camden': (51.5390, -0.1426),
+    'Marylebone': (51.5186, -0.1500),
+    'Notting Hill': (51.5090, -0.1960),
+    "King's Cross": (51.5308, -0.1238),
+    'Clerkenwell': (51.5246, -0.1101),
+    'Mayfair': (51.5101, -0.1470),
+}
+
+PREFERENCES = [
+    "I'd love a vegan restaurant",
+    "somewhere for Italian pasta",
+    "good sushi please",
+    "Korean barbecue with friends",
+    "a brunch spot with outdoor seating",
+    "halal burgers",
+    "gluten free, maybe a bakery",
+    "an Indian curry house",
+    "a seafood restaurant for a date",
+    "dim sum for lunch",
+    "a cosy French bistro",
+    "Mexican tacos and margaritas",
+]
+
+
+def sessions(count, seed=0):
+    """Synthetic conversations: a preference, a starting area and the restaurant asked about."""
+    rng = random.Random(seed)
+    return [{
+        'id': i,
+        'preference': rng.choice(PREFERENCES),
+        'location': rng.choice(list(AREAS)),
+        'pick': rng.randint(1, 3),
+    } for i in range(count)]
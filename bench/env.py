@@ -0,0 +1,83 @@
+"""
+Process setup shared by the benchmark and the load test.
+
+configure() must run before the app modules are imported: it points the caches and rate
+limit buckets at a private work directory and, unless the run talks to the real APIs,
+the secrets and vector index too.
+"""
+import os
+import re
+import json
+import pickle
+import hashlib
+import numpy as np
+
+# Dimension of the stand-in embeddings, the index and the embeddings endpoint must agree
+DIMENSION = 256
+DOCSTORE_PATH = os.path.join('faiss_db', 'index.pkl')
+
+
+def configure(workdir, openai_rps=1000, google_rps=1000, fresh_cache=True, live=False):
+    os.makedirs(workdir, exist_ok=True)
+
+    cache_path = os.path.join(workdir, 'cache.sqlite')
+    if fresh_cache:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cache_path + suffix):
+                os.remove(cache_path + suffix)
+
+    os.environ['RESTAURANT_CACHE_PATH'] = cache_path
+    os.environ['RESTAURANT_HISTORY_PATH'] = os.path.join(workdir, 'history.sqlite')
+    os.environ['RESTAURANT_RATE_LIMIT_DIR'] = os.path.join(workdir, 'ratelimit')
+    os.environ['OPENAI_RPS'] = str(openai_rps)
+    os.environ['GOOGLE_RPS'] = str(google_rps)
+
+    if live:
+        # Recording and replaying real responses needs the real keys and the real index
+        import streamlit as st
+        os.environ['OPENAI_API_KEY'] = st.secrets['OPENAI_API_KEY']
+        return None
+
+    os.environ['RESTAURANT_INDEX_PATH'] = os.path.join(workdir, 'index')
+    os.environ['OPENAI_API_KEY'] = 'sk-bench'
+
+    # st.secrets is read lazily, so pointing it at dummy keys here is enough
+    secrets_path = os.path.join(workdir, 'secrets.toml')
+    with open(secrets_path, 'w') as f:
+        f.write('OPENAI_API_KEY = "sk-bench"\nGOOGLE_API_KEY = "bench"\n')
+    from streamlit import config
+    config.set_option('secrets.files', [secrets_path])
+    return secrets_path
+
+
+def load_restaurants(path=DOCSTORE_PATH):
+    # (document, name, fields) for every restaurant in the pickled docstore, no FAISS index needed
+    with open(path, 'rb') as f:
+        docstore, index_to_id = pickle.load(f)
+    restaurants = []
+    for i in range(len(index_to_id)):
+        doc = docstore.search(index_to_id[i])
+        content = json.loads(doc.page_content)
+        name = next(iter(content))
+        restaurants.append((doc, name, content[name]))
+    return restaurants
+
+
+def embed_text(text):
+    """Deterministic bag-of-words vector, so queries still land near restaurants that mention them."""
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    for word in re.findall(r"[a-z]+", text.lower()):
+        digest = hashlib.md5(word.encode('utf-8')).digest()
+        vector[int.from_bytes(digest[:4], 'little') % DIMENSION] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def build_index(restaurants, path):
+    # Built once per work directory, the stand-in vectors never change
+    from vector_store import MmapVectorStore, write_store
+    if MmapVectorStore.exists(path):
+        return
+    vectors = np.stack([embed_text(doc.page_content) for doc, _, _ in restaurants])
+    write_store(path, vectors, (doc for doc, _, _ in restaurants))
+    print(f"Built a {DIMENSION}-dimension stand-in index for {len(restaurants)} restaurants in {path}")
@@ -0,0 +1,201 @@
+"""
+Load test: many simulated chat sessions running app.py concurrently in one process.
+
+Each virtual user is a Streamlit AppTest with its own session_state, sending the messages of
+a synthetic conversation turn by turn ('prepare' -> 'location' -> 'generate' -> 'continuation')
+against the stand-in upstreams of bench/upstream.py. The report gives throughput, the turn
+latency distribution, process memory growth and how session_state grows per session.
+
+Usage:
+    python -m bench.load [--users 8] [--sessions 32] [--cycles 1] [--latency google=0.05,openai=0.4] [--json report.json]
+"""
+import os
+import json
+import time
+import pickle
+import argparse
+import resource
+import threading
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from bench import env
+from bench.corpus import sessions
+from bench.run import parse_latency
+
+WORKDIR = os.path.join('.cache', 'bench')
+# Follow-up messages after the first page: another page, then details of one restaurant
+FOLLOW_UPS = ['more', '{pick}']
+
+
+def conversation(session, cycles):
+    # The messages one virtual user sends, a full search repeated `cycles` times
+    messages = []
+    for cycle in range(cycles):
+        if cycle:
+            messages.append('change preferences')
+        messages += [session['preference'], session['location']]
+        messages += [message.format(pick=session['pick']) for message in FOLLOW_UPS]
+    return messages
+
+
+def state_size(at):
+    # Pickled size of what a session keeps between turns, and of its chat history alone
+    state = {key: at.session_state[key] for key in ('memories', 'context', 'preference', 'location', 'options') if key in at.session_state}
+    return len(pickle.dumps(state)), len(pickle.dumps(state.get('memories', [])))
+
+
+class LoadResults:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = defaultdict(list)
+        self.sessions = []
+        self.failures = []
+
+    def turn(self, state, seconds):
+        with self.lock:
+            self.turns[state].append(seconds)
+
+    def session(self, record):
+        with self.lock:
+            self.sessions.append(record)
+
+    def failure(self, session_id, error):
+        with self.lock:
+            self.failures.append({'session': session_id, 'error': error})
+
+
+def share_runtime():
+    """
+    AppTest installs a mock Runtime for each run and removes it when the run ends, so
+    concurrent runs would remove it under each other. Fall back to one shared mock instead.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or shared)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+def run_user(session, cycles, results, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file('app.py', default_timeout=timeout)
+    at.run()
+    growth = []
+    for message in conversation(session, cycles):
+        state = at.session_state['state']
+        start = time.perf_counter()
+        at.chat_input[0].set_value(message).run()
+        results.turn(state, time.perf_counter() - start)
+        if at.exception:
+            results.failure(session['id'], str(at.exception[0].value))
+            return
+        growth.append({'state_bytes': state_size(at)[0], 'memories': len(at.session_state['memories']), 'memories_bytes': state_size(at)[1]})
+    results.session({'id': session['id'], 'turns': len(growth), 'growth': growth})
+
+
+def percentiles(samples):
+    return {f"p{q}_ms": round(float(np.percentile(samples, q)) * 1000, 1) for q in (50, 90, 95, 99)}
+
+
+def report(results, elapsed, args, rss_start, traced):
+    all_turns = [seconds for samples in results.turns.values() for seconds in samples]
+    finished = [record for record in results.sessions if record['growth']]
+    last = [record['growth'][-1] for record in finished]
+    first = [record['growth'][0] for record in finished]
+    return {
+        'users': args.users,
+        'sessions': args.sessions,
+        'completed': len(results.sessions),
+        'failures': results.failures,
+        'elapsed_s': round(elapsed, 2),
+        'turns_per_s': round(len(all_turns) / elapsed, 2) if elapsed else None,
+        'sessions_per_min': round(len(results.sessions) / elapsed * 60, 2) if elapsed else None,
+        'turn_latency': percentiles(all_turns) if all_turns else {},
+        'turn_latency_by_state': {state: {'turns': len(samples), **percentiles(samples)} for state, samples in sorted(results.turns.items(), key=lambda item: str(item[0]))},
+        'rss_growth_mib': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / 1024, 1),
+        'traced_peak_mib': round(traced / 2 ** 20, 1) if traced is not None else None,
+        'per_session': {
+            'memories_after_last_turn': round(float(np.mean([g['memories'] for g in last])), 1) if last else None,
+            'memories_kib_after_first_turn': round(float(np.mean([g['memories_bytes'] for g in first])) / 1024, 1) if first else None,
+            'memories_kib_after_last_turn': round(float(np.mean([g['memories_bytes'] for g in last])) / 1024, 1) if last else None,
+            'state_kib_after_last_turn': round(float(np.mean([g['state_bytes'] for g in last])) / 1024, 1) if last else None,
+        },
+    }
+
+
+def print_report(summary, args):
+    print(f"\n{summary['completed']}/{summary['sessions']} sessions with {summary['users']} concurrent users in {summary['elapsed_s']} s, "
+          f"latency {args.latency or 'none'}, {args.cycles} search(es) per session")
+    print(f"throughput: {summary['turns_per_s']} turns/s, {summary['sessions_per_min']} sessions/min")
+    print(f"turn latency: {summary['turn_latency']}")
+    for state, row in summary['turn_latency_by_state'].items():
+        print(f"  {str(state):<14}{row}")
+    print(f"process RSS growth: {summary['rss_growth_mib']} MiB, traced peak: {summary['traced_peak_mib']} MiB")
+    print(f"per session: {summary['per_session']}")
+    for failure in summary['failures'][:5]:
+        print(f"failed session {failure['session']}: {failure['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help='conversations running at the same time')
+    parser.add_argument('--sessions', type=int, default=32, help='conversations in total')
+    parser.add_argument('--cycles', type=int, default=1, help='searches per conversation, more cycles grow the history')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', default='', help='seconds added per upstream response, e.g. google=0.05,openai=0.4')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--openai-rps', type=float, default=1000)
+    parser.add_argument('--google-rps', type=float, default=1000)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds one turn may take')
+    parser.add_argument('--memory', action='store_true', help='trace Python allocations, slows the run down')
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--json', help='also write the report here')
+    args = parser.parse_args()
+
+    env.configure(args.workdir, args.openai_rps, args.google_rps)
+    restaurants = env.load_restaurants()
+    env.build_index(restaurants, os.environ['RESTAURANT_INDEX_PATH'])
+
+    from bench.upstream import FakeUpstream
+    from utils import get_embeddings
+
+    # Token counting for long inputs needs a tiktoken download, which cannot be replayed
+    get_embeddings().embeddings.check_embedding_ctx_length = False
+
+    share_runtime()
+    results = LoadResults()
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.memory:
+        tracemalloc.start()
+
+    with FakeUpstream(restaurants, parse_latency(args.latency), args.jitter, seed=args.seed):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix='user') as pool:
+            futures = [pool.submit(run_user, session, args.cycles, results, args.timeout) for session in sessions(args.sessions, args.seed)]
+            for future, session in zip(futures, sessions(args.sessions, args.seed)):
+                try:
+                    future.result()
+                except Exception as e:
+                    results.failure(session['id'], repr(e))
+        elapsed = time.perf_counter() - start
+
+    traced = tracemalloc.get_traced_memory()[1] if args.memory else None
+    summary = report(results, elapsed, args, rss_start, traced)
+    print_report(summary, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), **summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
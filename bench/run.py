@@ -0,0 +1,185 @@
+"""
+Offline benchmark of the recommendation pipeline, stage by stage.
+
+Every synthetic session goes through read_turn -> get_context -> get_distance_and_review
+-> generate_recommendations -> further_info on the request engine, against recorded or
+synthesized upstream responses, and the report gives p50/p95 latency, upstream calls,
+tokens and peak traced memory per stage.
+
+Usage:
+    python -m bench.run [--sessions 20] [--latency google=0.05,openai=0.4] [--jitter 0.2]
+                        [--fixtures bench/fixtures.json] [--strict] [--warm] [--json report.json]
+    python -m bench.run --record bench/fixtures.json --sessions 5
+
+Without --record or --fixtures everything is synthesized from the docstore and a stand-in index,
+so no keys are needed. Recording and replaying use the app's secrets and vector index.
+"""
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from collections import Counter, defaultdict
+import numpy as np
+
+from bench import env
+from bench.corpus import sessions
+
+STAGES = ['read_turn', 'get_context', 'get_distance_and_review', 'generate_recommendations', 'further_info']
+WORKDIR = os.path.join('.cache', 'bench')
+
+
+def parse_latency(text):
+    # "google=0.05,openai=0.4" -> {'google': 0.05, 'openai': 0.4}
+    latency = {}
+    for part in filter(None, (text or '').split(',')):
+        api, _, seconds = part.partition('=')
+        latency[api.strip()] = float(seconds)
+    return latency
+
+
+class Recorder:
+    """Times one stage at a time and attributes upstream calls, tokens and memory to it."""
+
+    def __init__(self, upstream, memory=True):
+        self.upstream = upstream
+        self.memory = memory
+        self.latency = defaultdict(list)
+        self.calls = defaultdict(Counter)
+        self.tokens = defaultdict(Counter)
+        self.peak = defaultdict(list)
+
+    def measure(self, stage, func):
+        calls, tokens = self.upstream.snapshot()
+        if self.memory:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.latency[stage].append(time.perf_counter() - start)
+            if self.memory:
+                self.peak[stage].append(tracemalloc.get_traced_memory()[1] - current)
+            after_calls, after_tokens = self.upstream.snapshot()
+            self.calls[stage] += after_calls - calls
+            self.tokens[stage] += after_tokens - tokens
+
+    def report(self, sessions_run):
+        rows = {}
+        for stage in STAGES:
+            samples = self.latency.get(stage)
+            if not samples:
+                continue
+            rows[stage] = {
+                'runs': len(samples),
+                'p50_ms': round(float(np.percentile(samples, 50)) * 1000, 1),
+                'p95_ms': round(float(np.percentile(samples, 95)) * 1000, 1),
+                'calls_per_run': {api: round(count / len(samples), 2) for api, count in sorted(self.calls[stage].items())},
+                'tokens_per_run': {kind: round(count / len(samples)) for kind, count in sorted(self.tokens[stage].items())},
+                'peak_kib': round(max(self.peak[stage]) / 1024, 1) if self.peak.get(stage) else None,
+            }
+        return {'sessions': sessions_run, 'stages': rows}
+
+
+def run_session(session, recorder, app):
+    service, get_geolocation, is_far, render_card, further_info_prompt, stream_tokens, get_chat_model = app
+
+    # Same reading as gpt_functions.read_turn on the first message, without the chat UI
+    def turn():
+        turn = service.run(service.read_turn('prepare', f"{session['preference']} near {session['location']}"))
+        location = turn.location or session['location']
+        return turn.preference or session['preference'], location, get_geolocation(location)
+    preference_text, location, (lat, lng) = recorder.measure('read_turn', turn)
+
+    context = recorder.measure('get_context', lambda: service.run(service.get_context(preference_text, lat, lng)))
+
+    restaurants = recorder.measure('get_distance_and_review', lambda: service.run(service.get_distance_and_review(location, context, lat, lng)))
+    if is_far(restaurants):
+        return False
+
+    def recommendations():
+        page = restaurants[:3]
+        prose = service.run(service.generate_recommendations(page))
+        return [render_card(i + 1, restaurant, value or {}) for i, (restaurant, value) in enumerate(zip(page, prose))]
+    recorder.measure('generate_recommendations', recommendations)
+
+    def details():
+        selected = restaurants[:3][min(session['pick'], len(restaurants[:3])) - 1]
+        restaurant_dict = selected[next(iter(selected))]
+        metro, place = service.run(service.further_info(restaurant_dict))
+        metro_name, distance, duration = metro or ('N/A', 'N/A', 'N/A')
+        prompt = further_info_prompt(place or restaurant_dict, metro_name, distance, duration)
+        return "".join(stream_tokens(get_chat_model(), prompt))
+    recorder.measure('further_info', details)
+    return True
+
+
+def print_report(report, args):
+    print(f"\n{report['sessions']} sessions, latency {args.latency or 'none'}, jitter {args.jitter}, {'warm' if args.warm else 'cold'} cache")
+    print(f"{'stage':<26}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'peak KiB':>10}  calls / tokens per run")
+    for stage, row in report['stages'].items():
+        peak = '-' if row['peak_kib'] is None else row['peak_kib']
+        print(f"{stage:<26}{row['runs']:>6}{row['p50_ms']:>10}{row['p95_ms']:>10}{peak:>10}  {row['calls_per_run']} {row['tokens_per_run']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', default='', help='seconds added per upstream response, e.g. google=0.05,openai=0.4')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- fraction applied to the latency')
+    parser.add_argument('--fixtures', help='recorded responses to replay, others are synthesized')
+    parser.add_argument('--strict', action='store_true', help='fail on requests missing from --fixtures')
+    parser.add_argument('--record', help='call the real APIs and save their responses here')
+    parser.add_argument('--warm', action='store_true', help='keep the cache from the previous run')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, it slows every stage down')
+    parser.add_argument('--openai-rps', type=float, default=1000)
+    parser.add_argument('--google-rps', type=float, default=1000)
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--json', help='also write the report here')
+    args = parser.parse_args()
+
+    # Recorded responses only match the searches of the index they were recorded with
+    live = bool(args.record or args.fixtures)
+    env.configure(args.workdir, args.openai_rps, args.google_rps, fresh_cache=not args.warm, live=live)
+    restaurants = env.load_restaurants()
+    if not live:
+        env.build_index(restaurants, os.environ['RESTAURANT_INDEX_PATH'])
+
+    # App modules read the environment set above when they are imported
+    from bench.upstream import FakeUpstream
+    import service
+    from maps_function import get_geolocation, is_far
+    from cards import render_card
+    from gpt_functions import further_info_prompt
+    from utils import get_embeddings, get_chat_model, stream_tokens
+
+    # Token counting for long inputs needs a tiktoken download, which cannot be replayed
+    get_embeddings().embeddings.check_embedding_ctx_length = False
+    app = (service, get_geolocation, is_far, render_card, further_info_prompt, stream_tokens, get_chat_model)
+
+    upstream = FakeUpstream(restaurants, parse_latency(args.latency), args.jitter, args.fixtures, args.record, args.strict, args.seed)
+    recorder = Recorder(upstream, memory=not args.no_memory)
+    if recorder.memory:
+        tracemalloc.start()
+
+    completed = 0
+    with upstream:
+        for session in sessions(args.sessions, args.seed):
+            try:
+                completed += run_session(session, recorder, app)
+            except Exception as e:
+                print(f"Session {session['id']} failed: {e!r}")
+
+    report = recorder.report(args.sessions)
+    report['completed'] = completed
+    print_report(report, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), **report}, f, indent=2)
+    service.get_engine().close()
+
+
+if __name__ == '__main__':
+    main()
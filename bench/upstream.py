@@ -0,0 +1,350 @@
+"""
+Transport-level stand-in for the OpenAI and Google Maps APIs.
+
+Requests never leave the process: requests' HTTPAdapter and httpx's transports are patched,
+so the app's own clients, retries, rate limiters and parsers all run unchanged. Responses
+come from recorded fixtures when available and are synthesized from the docstore otherwise.
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from geo import haversine_km
+from bench.env import embed_text
+from bench.corpus import AREAS
+
+LONDON = (51.5074, -0.1278)
+# Query parameters that hold credentials never become part of a fixture key
+SECRET_PARAMS = {'key'}
+
+
+def request_key(method, url, body):
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS)
+    digest = hashlib.sha256(body or b'').hexdigest()[:16]
+    return f"{method} {parts.netloc}{parts.path}?{query} {digest}"
+
+
+def endpoint(url):
+    # ('google' | 'openai', short endpoint name) for call counts and latency
+    parts = urlsplit(url)
+    if parts.netloc == 'api.openai.com':
+        return 'openai', parts.path.rsplit('/', 1)[-1]
+    if parts.netloc.endswith('googleapis.com'):
+        if '/distancematrix/' in parts.path:
+            return 'google', 'distancematrix'
+        if '/geocode/' in parts.path:
+            return 'google', 'geocode'
+        return 'google', 'places_search' if ':searchNearby' in parts.path else 'place_details'
+    return 'other', parts.netloc
+
+
+class FakeUpstream:
+    """
+    Patches the HTTP transports while installed.
+
+    latency maps 'openai' / 'google' to seconds added to every response, jitter is the
+    +/- fraction applied to it. With `record` set, requests go to the real APIs and the
+    responses are saved there on uninstall.
+    """
+
+    def __init__(self, restaurants, latency=None, jitter=0.0, fixtures=None, record=None, strict=False, seed=0):
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.record = record
+        self.strict = strict
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.tokens = Counter()
+        self.patched = {}
+
+        self.fixtures = {}
+        if fixtures:
+            with open(fixtures) as f:
+                self.fixtures = json.load(f)
+        self.recorded = {}
+
+        self.by_address = {}
+        self.by_place_id = {}
+        for _, name, fields in restaurants:
+            if fields.get('Place ID'):
+                self.by_place_id[fields['Place ID']] = (name, fields)
+            try:
+                self.by_address[fields['Address']] = (float(fields['Latitude']), float(fields['Longitude']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.stations = {}
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls), Counter(self.tokens)
+
+    def count(self, api, name, payload):
+        with self.lock:
+            self.calls[f"{api}.{name}"] += 1
+            usage = payload.get('usage') if isinstance(payload, dict) else None
+            if usage:
+                self.tokens['input'] += usage.get('prompt_tokens', 0)
+                self.tokens['output'] += usage.get('completion_tokens', 0)
+
+    def delay(self, api):
+        seconds = self.latency.get(api, 0.0)
+        if seconds and self.jitter:
+            seconds *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, seconds)
+
+    def install(self):
+        upstream = self
+        self.patched = {
+            (HTTPAdapter, 'send'): HTTPAdapter.send,
+            (httpx.HTTPTransport, 'handle_request'): httpx.HTTPTransport.handle_request,
+            (httpx.AsyncHTTPTransport, 'handle_async_request'): httpx.AsyncHTTPTransport.handle_async_request,
+        }
+        original_send = HTTPAdapter.send
+        original_sync = httpx.HTTPTransport.handle_request
+        original_async = httpx.AsyncHTTPTransport.handle_async_request
+
+        def send(adapter, request, **kwargs):
+            if upstream.record:
+                response = original_send(adapter, request, **kwargs)
+                upstream.save(request.method, request.url, request.body, response.status_code, response.headers, response.content)
+                return response
+            api, _ = endpoint(request.url)
+            time.sleep(upstream.delay(api))
+            body = request.body.encode('utf-8') if isinstance(request.body, str) else request.body
+            status, headers, content = upstream.respond(request.method, request.url, body, request.headers)
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response._content = content
+            response.encoding = 'utf-8'
+            response.url = request.url
+            response.request = request
+            return response
+
+        def handle_request(transport, request):
+            if upstream.record:
+                response = original_sync(transport, request)
+                content = response.read()
+                upstream.save(request.method, str(request.url), request.content, response.status_code, response.headers, content)
+                return httpx.Response(response.status_code, headers=response.headers, content=content, request=request)
+            api, _ = endpoint(str(request.url))
+            time.sleep(upstream.delay(api))
+            status, headers, content = upstream.respond(request.method, str(request.url), request.read(), request.headers)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        async def handle_async_request(transport, request):
+            if upstream.record:
+                response = await original_async(transport, request)
+                content = await response.aread()
+                upstream.save(request.method, str(request.url), request.content, response.status_code, response.headers, content)
+                return httpx.Response(response.status_code, headers=response.headers, content=content, request=request)
+            api, _ = endpoint(str(request.url))
+            await asyncio.sleep(upstream.delay(api))
+            status, headers, content = upstream.respond(request.method, str(request.url), await request.aread(), request.headers)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        HTTPAdapter.send = send
+        httpx.HTTPTransport.handle_request = handle_request
+        httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+        return self
+
+    def uninstall(self):
+        for (owner, name), original in self.patched.items():
+            setattr(owner, name, original)
+        self.patched = {}
+        if self.record:
+            with open(self.record, 'w') as f:
+                json.dump(self.recorded, f, ensure_ascii=False)
+            print(f"Recorded {len(self.recorded)} responses to {self.record}")
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def save(self, method, url, body, status, headers, content):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        api, name = endpoint(url)
+        entry = {'status': status, 'content_type': headers.get('content-type', 'application/json'), 'body': content.decode('utf-8')}
+        with self.lock:
+            self.recorded[request_key(method, url, body)] = entry
+        self.count(api, name, self.usage_of(entry))
+
+    def usage_of(self, entry):
+        # Usage block of a JSON response, or of the last streamed chunk that carries one
+        if entry['content_type'].startswith('text/event-stream'):
+            for line in reversed(entry['body'].splitlines()):
+                if line.startswith('data: {') and '"usage"' in line:
+                    return json.loads(line[len('data: '):])
+            return {}
+        try:
+            return json.loads(entry['body'])
+        except ValueError:
+            return {}
+
+    def respond(self, method, url, body, headers):
+        api, name = endpoint(url)
+        # Anything else, e.g. tiktoken's encoding download, fails as it would offline
+        if api == 'other':
+            return 404, {'content-type': 'text/plain'}, b'offline'
+        entry = self.fixtures.get(request_key(method, url, body))
+        if entry is None:
+            if self.strict:
+                raise RuntimeError(f"No recorded response for {method} {url}")
+            entry = self.synthesize(api, name, url, body, headers)
+        self.count(api, name, self.usage_of(entry))
+        return entry['status'], {'content-type': entry['content_type']}, entry['body'].encode('utf-8')
+
+    def synthesize(self, api, name, url, body, headers):
+        params = dict(parse_qsl(urlsplit(url).query))
+        payload = json.loads(body) if body else {}
+        handler = {
+            'geocode': lambda: self.geocode(params['address']),
+            'distancematrix': lambda: self.distance_matrix(params['origins'], params['destinations'].split('|'), params.get('mode')),
+            'places_search': lambda: self.nearby_station(payload),
+            'place_details': lambda: self.place_details(urlsplit(url).path.rsplit('/', 1)[-1]),
+            'embeddings': lambda: self.embeddings(payload),
+            'completions': lambda: self.chat(payload),
+        }.get(name)
+        if handler is None:
+            return {'status': 404, 'content_type': 'application/json', 'body': json.dumps({'error': {'message': f'No stand-in for {url}'}})}
+        result = handler()
+        if isinstance(result, dict) and 'status' in result and 'body' in result:
+            return result
+        return {'status': 200, 'content_type': 'application/json', 'body': json.dumps(result)}
+
+    def locate(self, address):
+        if address in self.by_address:
+            return self.by_address[address]
+        if address in self.stations:
+            return self.stations[address]
+        for area, coords in AREAS.items():
+            if area.lower() in address.lower():
+                return coords
+        # Unknown places land somewhere central, but always in the same spot
+        digest = hashlib.md5(address.encode('utf-8')).digest()
+        return LONDON[0] + (digest[0] - 128) / 6400, LONDON[1] + (digest[1] - 128) / 3200
+
+    def geocode(self, address):
+        lat, lng = self.locate(address)
+        return {'status': 'OK', 'results': [{'formatted_address': address, 'geometry': {'location': {'lat': lat, 'lng': lng}}}]}
+
+    def distance_matrix(self, origin, destinations, mode):
+        start = self.locate(origin)
+        elements = []
+        for destination in destinations:
+            km = haversine_km(*start, *self.locate(destination)) * 1.3
+            if mode == 'transit':
+                element = {'status': 'OK', 'distance': {'text': f"{km:.1f} km", 'value': int(km * 1000)},
+                           'duration': {'text': f"{int(5 + km * 3)} mins", 'value': int(300 + km * 180)},
+                           'fare': {'text': '£2.80', 'value': 2.8, 'currency': 'GBP'}}
+            else:
+                element = {'status': 'OK', 'distance': {'text': f"{km:.1f} km", 'value': int(km * 1000)},
+                           'duration': {'text': f"{max(1, int(km * 12))} mins", 'value': int(km * 720)}}
+            elements.append(element)
+        return {'status': 'OK', 'origin_addresses': [origin], 'destination_addresses': destinations, 'rows': [{'elements': elements}]}
+
+    def nearby_station(self, payload):
+        center = payload['locationRestriction']['circle']['center']
+        lat, lng = center['latitude'] + 0.002, center['longitude'] - 0.001
+        area = min(AREAS, key=lambda a: haversine_km(lat, lng, *AREAS[a]))
+        address = f"{area} Station, London"
+        self.stations[address] = (lat, lng)
+        return {'places': [{'displayName': {'text': f"{area} Station"}, 'formattedAddress': address, 'location': {'latitude': lat, 'longitude': lng}}]}
+
+    def place_details(self, place_id):
+        if place_id not in self.by_place_id:
+            return {'status': 404, 'content_type': 'application/json', 'body': json.dumps({'error': {'code': 404, 'message': 'Place not found'}})}
+        name, fields = self.by_place_id[place_id]
+        rng = random.Random(place_id)
+        reviews = [{
+            'rating': rng.randint(3, 5),
+            'text': {'text': f"Lovely evening at {name}, the food was {rng.choice(['excellent', 'very good', 'decent', 'fresh'])} and the staff {rng.choice(['friendly', 'quick', 'attentive'])}."},
+            'publishTime': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00Z",
+        } for _ in range(5)]
+        return {
+            'displayName': {'text': name},
+            'formattedAddress': fields.get('Address', ''),
+            'internationalPhoneNumber': '+44 20 7946 0000',
+            'priceLevel': 'PRICE_LEVEL_MODERATE',
+            'reservable': True,
+            'googleMapsUri': f"https://maps.google.com/?cid={place_id}",
+            'websiteUri': fields.get('Website', ''),
+            'regularOpeningHours': {'openNow': True, 'weekdayDescriptions': ['Monday: 12:00 – 22:00']},
+            'rating': round(rng.uniform(3.8, 4.9), 1),
+            'userRatingCount': rng.randint(50, 3000),
+            'reviews': reviews,
+        }
+
+    def embeddings(self, payload):
+        texts = payload['input'] if isinstance(payload['input'], list) else [payload['input']]
+        tokens = sum(len(str(text)) // 4 for text in texts)
+        return {
+            'object': 'list',
+            'model': payload.get('model', 'text-embedding-ada-002'),
+            'data': [{'object': 'embedding', 'index': i, 'embedding': embed_text(str(text)).tolist()} for i, text in enumerate(texts)],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        }
+
+    def read_turn(self, payload):
+        # Arguments of the Turn tool call, guessed from the state and message in the prompt
+        text = "\n".join(str(message.get('content', '')) for message in payload['messages'])
+        state = text.split('The assistant is currently', 1)[-1].split('.', 1)[0]
+        message = text.rsplit('User message:', 1)[-1].strip()
+        if 'starting point' in state:
+            return {'intent': 'location', 'location': message}
+        if 'numbered list' in state:
+            return {'intent': 'number', 'number': int(message)} if message.isdigit() else {'intent': 'other'}
+        if message.isdigit():
+            return {'intent': 'neither'}
+        area = next((name for name in AREAS if name.lower() in message.lower()), None)
+        preference = message.split(' near ')[0].strip()
+        return {'intent': 'preference', 'preference': preference, 'location': area}
+
+    def chat_answer(self, payload):
+        text = "\n".join(str(message.get('content', '')) for message in payload['messages'])
+        if payload.get('response_format', {}).get('type') == 'json_object':
+            keys = {'review_summary': 'Guests praise the food and the friendly service.'}
+            if '"description"' in text:
+                keys['description'] = 'A relaxed neighbourhood favourite with a short, seasonal menu and a loyal following.'
+            return json.dumps(keys)
+        return "## Restaurant details\nAddress, opening hours and the walk from the nearest station are listed above.\nPick another number, ask for more options or set new preferences."
+
+    def chat(self, payload):
+        answer = self.chat_answer(payload)
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in payload['messages']) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(answer) // 4, 'total_tokens': prompt_tokens + len(answer) // 4}
+        base = {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'created': int(time.time()), 'model': payload.get('model', 'gpt-4o')}
+
+        if payload.get('tools'):
+            arguments = json.dumps(self.read_turn(payload))
+            call = {'id': f"call_{uuid.uuid4().hex[:12]}", 'type': 'function',
+                    'function': {'name': payload['tools'][0]['function']['name'], 'arguments': arguments}}
+            return {**base, 'object': 'chat.completion', 'usage': usage,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': None, 'tool_calls': [call]}, 'finish_reason': 'tool_calls'}]}
+
+        if not payload.get('stream'):
+            return {**base, 'object': 'chat.completion', 'usage': usage,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}]}
+
+        words = answer.split(' ')
+        pieces = words[:1] + [' ' + word for word in words[1:]]
+        chunks = [{**base, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}, 'finish_reason': None}]}
+                  for piece in pieces]
+        chunks.append({**base, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if payload.get('stream_options', {}).get('include_usage'):
+            chunks.append({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})
+        body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+        return {'status': 200, 'content_type': 'text/event-stream', 'body': body}
@@ -0,0 +1,281 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from functools import wraps
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Shared on-disk tier, every Streamlit session and worker process on the host reads the same file
+CACHE_PATH = os.environ.get('RESTAURANT_CACHE_PATH', os.path.join('.cache', 'restaurant_cache.sqlite'))
+
+# Time to live per endpoint (seconds)
+HOUR = 60 * 60
+DAY = 24 * HOUR
+TTL = {
+    'geocode': 30 * DAY,
+    'place_info': 7 * DAY,
+    'google_reviews': DAY,
+    'walking_distance': 30 * DAY,
+    'transit_distance': 6 * HOUR,
+    'nearest_metro': 30 * DAY,
+    'embedding': 30 * DAY,
+    'search': DAY,
+    'prose': DAY,
+    'page': 6 * HOUR,
+}
+
+
+class TTLCache:
+    """
+    Two tier cache: an in-process LRU in front of a SQLite table shared between processes.
+
+    Values are stored as JSON, so only JSON serializable results should be cached.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=2048):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = defaultdict(lambda: {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+
+    def _connection(self):
+        if self.path is None:
+            return None
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key TEXT, value TEXT, expires REAL, PRIMARY KEY (namespace, key))")
+            self.local.conn = conn
+        return conn
+
+    def _remember(self, full_key, expires, value):
+        with self.lock:
+            self.memory[full_key] = (expires, value)
+            self.memory.move_to_end(full_key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, namespace, key):
+        now = time.time()
+        full_key = (namespace, key)
+
+        with self.lock:
+            entry = self.memory.get(full_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(full_key)
+                    self.counters[namespace]['memory_hits'] += 1
+                    return True, entry[1]
+                del self.memory[full_key]
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                row = conn.execute("SELECT value, expires FROM cache WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Cache read failed: {e}")
+                row = None
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(full_key, row[1], value)
+                with self.lock:
+                    self.counters[namespace]['disk_hits'] += 1
+                return True, value
+
+        with self.lock:
+            self.counters[namespace]['misses'] += 1
+        return False, None
+
+    def set(self, namespace, key, value, ttl):
+        expires = time.time() + ttl
+        self._remember((namespace, key), expires, value)
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (namespace, key, json.dumps(value), expires))
+                    conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                print(f"Cache write failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {namespace: dict(counts) for namespace, counts in self.counters.items()}
+
+
+maps_cache = TTLCache()
+
+# LLM written descriptions and review summaries, keyed by Place ID
+prose_cache = TTLCache(max_entries=512)
+
+
+def cached(namespace, ttl=None, cache=maps_cache):
+    """
+    Decorator that caches a function's result by its positional arguments.
+
+    Failed results (None / False) are never cached so they are retried on the next call.
+    """
+    ttl = TTL[namespace] if ttl is None else ttl
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            key = json.dumps(args, default=str)
+            found, value = cache.get(namespace, key)
+            if found:
+                return value
+
+            value = func(*args)
+            if value is not None and value is not False:
+                cache.set(namespace, key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def normalize_query(text):
+    # "Preference = Vegan  restaurant" and "preference = vegan restaurant" share one entry
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so repeated queries are embedded only once.
+
+    Queries are keyed by a hash of the model name and the normalized text.
+    `rate_limit` is called before every upstream request, i.e. on cache misses only.
+    """
+
+    def __init__(self, embeddings, cache=None, rate_limit=None):
+        self.embeddings = embeddings
+        self.rate_limit = rate_limit
+        self.cache = TTLCache(max_entries=512) if cache is None else cache
+        self.model = getattr(embeddings, 'model', type(embeddings).__name__)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\n{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+    def embed_query(self, text):
+        key = self.key(text)
+        found, vector = self.cache.get('embedding', key)
+        if found:
+            return vector
+
+        if self.rate_limit is not None:
+            self.rate_limit()
+        vector = self.embeddings.embed_query(text)
+        self.cache.set('embedding', key, vector, TTL['embedding'])
+        return vector
+
+    def embed_documents(self, texts):
+        # Documents are only embedded when the store is built, no need to cache them
+        return self.embeddings.embed_documents(texts)
+
+
+# Top-k search results hold Document objects, so they stay in memory only
+search_cache = TTLCache(path=None, max_entries=256)
+
+
+# ada-002 cosine scores sit in a narrow high band: unrelated food queries still score around 0.8
+# and different cuisines phrased alike ("vegan restaurant" / "vegetarian restaurant") about 0.93-0.96.
+# Only rewordings of the same preference reach 0.98, so that is where a page is reused.
+PAGE_SIMILARITY = float(os.environ.get('RESTAURANT_PAGE_SIMILARITY', 0.98))
+
+
+class SemanticPageCache:
+    """
+    Enriched candidate lists of answered searches, keyed by location cell and preference embedding.
+
+    A search is a hit when an unexpired entry in the same cell has a preference embedding with
+    a cosine similarity of at least `threshold`. Entries live in the shared SQLite file, so every
+    worker process sees them; the least recently used are evicted beyond `max_entries`.
+
+    Cached entries hold no per-origin fields, the caller recomputes those for its own origin.
+    """
+
+    def __init__(self, path=CACHE_PATH, threshold=PAGE_SIMILARITY, max_entries=1000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS pages (cell TEXT, query TEXT, vector BLOB, value TEXT, expires REAL, last_used REAL, PRIMARY KEY (cell, query))")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, event):
+        with self.lock:
+            self.counters['page'][event] += 1
+
+    def get(self, cell, vector):
+        # (found, value) of the most similar unexpired entry in the cell
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        try:
+            conn = self._connection()
+            rows = conn.execute("SELECT query, vector, value FROM pages WHERE cell = ? AND expires > ?", (cell, now)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Page cache read failed: {e}")
+            rows = []
+
+        best, best_similarity = None, self.threshold
+        for key, blob, value in rows:
+            stored = np.frombuffer(blob, dtype=np.float32)
+            if stored.shape != query.shape:
+                continue
+            similarity = float(stored @ query)
+            if similarity >= best_similarity:
+                best, best_similarity = (key, value), similarity
+
+        if best is None:
+            self._count('misses')
+            return False, None
+
+        try:
+            with conn:
+                conn.execute("UPDATE pages SET last_used = ? WHERE cell = ? AND query = ?", (now, cell, best[0]))
+        except sqlite3.Error as e:
+            print(f"Page cache write failed: {e}")
+        self._count('hits')
+        return True, json.loads(best[1])
+
+    def set(self, cell, query, vector, value, ttl):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                             (cell, normalize_query(query), vector.tobytes(), json.dumps(value, default=float), now + ttl, now))
+                conn.execute("DELETE FROM pages WHERE expires <= ?", (now,))
+                conn.execute("DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Page cache write failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {namespace: dict(counts) for namespace, counts in self.counters.items()}
+
+
+# Whole candidate lists, shared by users asking for similar food in the same area
+page_cache = SemanticPageCache()
@@ -0,0 +1,45 @@
+import string
+
+from prompt_context import project_restaurant
+
+INTRO = "Here are some restaurants that match your preferences:\n"
+OUTRO = "\nWould you like to see other options or adjust your preferences? You can also put the number of a restaurant to know more about it in detail."
+
+
+def render_card(number, context_dict, prose):
+    """
+    Markdown for one recommended restaurant, built from the enriched context_dict.
+
+    Only the critic description and the Google review summary in prose come from the LLM.
+    """
+    restaurant = project_restaurant(context_dict)
+    sources = restaurant['unique_review_sources']
+
+    # capwords rather than str.title(), which would turn "Gordon's Wine Bar" into "Gordon'S Wine Bar"
+    lines = [
+        f"# {number}. {string.capwords(restaurant['name'])}",
+        f"From **{sources}** review{'s' if sources != 1 else ''}, the critics say:",
+        f"##### _{prose.get('description') or 'No description available.'}_",
+        "---",
+    ]
+
+    if restaurant['google_rating'] != 'NA':
+        lines += [
+            f"Overall Google rating is **{restaurant['google_rating']}** stars from **{restaurant['google_rating_count']}** reviews\n",
+            f"Average Google rating from last five reviews:  **{restaurant['average_rating_last_five']}**\n",
+        ]
+        if prose.get('review_summary'):
+            lines.append(f"`{prose['review_summary']} (latest review: {restaurant['latest_review']})`\n")
+        lines.append("---")
+
+    lines += [
+        f"- **Distance:** {restaurant['distance']}",
+        f"- **Duration:** {restaurant['duration']}",
+    ]
+    if restaurant['fare'] is not None:
+        lines.append(f"- **Fare:** {restaurant['fare']}")
+    lines.append(f"- **Address:** {restaurant['address']}")
+    if restaurant['instagram']:
+        lines.append(f"- **Instagram:** {restaurant['instagram']}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,89 @@
+import json
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Restaurants further than this from the user are never recommended
+MAX_DISTANCE_KM = 3
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def doc_coordinates(doc):
+    # Precomputed coordinates live in the metadata, older stores only have them in the page content
+    if 'latitude' in doc.metadata:
+        return doc.metadata['latitude'], doc.metadata['longitude']
+
+    try:
+        content = json.loads(doc.page_content)
+        restaurant = content[next(iter(content))]
+        return float(restaurant['Latitude']), float(restaurant['Longitude'])
+    except (ValueError, KeyError, TypeError, StopIteration):
+        return np.nan, np.nan
+
+
+def distances_km(lat, lng, docs):
+    # Unknown coordinates get an infinite distance
+    coords = np.array([doc_coordinates(doc) for doc in docs], dtype=float).reshape(-1, 2)
+    distances = haversine_km(lat, lng, coords[:, 0], coords[:, 1])
+    return np.where(np.isnan(distances), np.inf, distances)
+
+
+def within_radius(lat, lng, docs, radius_km=MAX_DISTANCE_KM):
+    """
+    Boolean mask of the docs whose straight line distance to (lat, lng) is within radius_km.
+
+    The straight line is never longer than the transit route, so nothing the online
+    distance check would keep is dropped here.
+    """
+    if lat is None or lng is None:
+        return np.ones(len(docs), dtype=bool)
+    return distances_km(lat, lng, docs) <= radius_km
+
+
+def hybrid_rank(docs_with_scores, lat, lng, distance_weight=0.3, radius_km=MAX_DISTANCE_KM):
+    """
+    Re-ranks (doc, relevance score) pairs by a weighted mix of relevance and proximity.
+
+    Docs outside radius_km are dropped, ties keep their FAISS order so pages stay stable.
+    """
+    if not docs_with_scores:
+        return []
+
+    scores = np.array([score for _, score in docs_with_scores], dtype=float)
+    distances = distances_km(lat, lng, [doc for doc, _ in docs_with_scores])
+    proximity = 1 - np.minimum(distances, radius_km) / radius_km
+
+    combined = (1 - distance_weight) * scores + distance_weight * proximity
+    order = np.argsort(-combined, kind='stable')
+    return [docs_with_scores[i] for i in order if distances[i] <= radius_km]
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat, lng, precision=6):
+    """Standard geohash of a point, precision 6 is a cell of about 1.2 x 0.6 km."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, bits, bit_count, even = [], 0, 0, True
+    while len(code) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        bounds, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits, bounds[0] = bits * 2 + 1, mid
+        else:
+            bits, bounds[1] = bits * 2, mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            code.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(code)
@@ -1,145 +1,179 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 import streamlit as st
 
-from utils import stream_data, off_topic_response
-from maps_function import get_geolocation, nearest_metro_walk, get_place_info
-
-def check_response(user_input):
-    model = ChatOpenAI(model="gpt-4o")
-    prompt = f"""
-        Based on this input: {user_input}, determine if:
-        - It indicates agreement, yes, or if the user wants another options, answer ONLY 'other'
-        - It indicates the user wants to choose/set/adjust to another preference, answer ONLY 'preference'
-        - If it indicates neither, answer ONLY 'neither'
-        - If it is a number, do not change it and answer as it is
-        - If it mentions a number, answer ONLY the number
-        - Do not answer more than the 1 word / 1 number
-    """
-    response_text = model.invoke(prompt).content
-    return response_text
-
-
-def get_preference(input):
-    system = """
-        Your role is to:
-        1. Evaluate whether the input relates to dining preferences, food choices, or any dietary restrictions.
-        2. Prioritize information based on: food type preference, dietary preference, restaurant type preference, and area/location preference.
-
-        Instructions:
-        - Rephrase the user's restaurant or food preference into a clear and concise statement, removing filler words and keeping only relevant information.
-        - Prioritize food preference/allergy, put additional information in a bracket. example: vegan restaurant (family-friendly)
-        - If the input is unrelated to dining or food preferences, return only "False"
-        - Otherwise, return the answer in the format: Preference = user's preference
-        - If the input indicate a location also return Location = user's location
-        - The location should be cleaned, meaning it should be stripped of filler words such as 'near', 'to', 'in', etc
-        """
-    
-    # prompt template, format the system message and user question
-    TEMPLATE = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            ("human", "User question: {input}"),
-        ]
-      )
-    prompt = TEMPLATE.format(input=input)
-    
-    model = ChatOpenAI(model="gpt-4o")
-    response_text = model.invoke(prompt).content
-
-    if response_text.lower() == 'false':
+import service
+from service import run
+from utils import stream_data, stream_tokens, off_topic_response, get_chat_model, get_embeddings
+from intent import classify_response, turn_from_label, Turn
+from prefetch import schedule, take
+from prompt_context import project_restaurant
+from cards import render_card, INTRO, OUTRO
+from summaries import stream_prose
+from maps_function import get_geolocation, is_far
+from tracing import traced
+
+@traced()
+def read_turn(user_input):
+    # Common replies to a page ("yes", "more", "2", "change preferences") never need the LLM
+    if st.session_state.state == 'continuation':
+        label = classify_response(user_input, get_embeddings())
+        if label is not None:
+            return turn_from_label(label)
+
+    try:
+        return run(service.read_turn(st.session_state.state, user_input, st.session_state.preference, st.session_state.location))
+    except (service.ServiceBusy, service.JobTimeout):
+        raise
+    except Exception as e:
+        print(f"Reading the message failed: {e!r}")
+        return Turn(intent='neither')
+
+
+@traced()
+def set_preference(turn):
+    # Typed fields from read_turn, the state only moves on once preference and location are known
+    if turn.preference:
+        st.session_state.preference = turn.preference
+    if turn.location:
+        st.session_state.location = turn.location
+
+    if not st.session_state.preference:
         off_topic_response('preference')
-    else:
-        if 'location' in response_text.lower():
-            st.session_state.location = response_text.split(' = ')[-1]
-            st.session_state.lat, st.session_state.lng = get_geolocation(st.session_state.location)
-            st.session_state.state = 'generate'
-            return response_text + f" latitude: {st.session_state.lat}, longitude: {st.session_state.lng}"
-
-        else:
-            answer = "\nNoted! Can you please tell me your starting point? It can be a specific address or an area."
-            st.session_state.memories.append({"role": "assistant", "content": answer})
-
-            with st.chat_message("assistant"):
-                st.write_stream(stream_data(answer))
-
-            st.session_state.state = 'location'
-            st.session_state.input = None
-            return response_text
-        
-def restaurant_summary(restaurant):
-    system = f"""
-    You are a polite and professional restaurant recommender assistant. Your task is to suggest restaurants based on user preferences inferred from chat history and context, which includes details about restaurants (cuisine, location, and distance).
-
-    Instructions & Structure:
-    - Identify user needs based on chat history (e.g., cuisine type, location).
-    - Format responses clearly and professionally, in the style of a restaurant reviewer.
-    - All restaurant given should be considered (3 recommendation if there's 3 restaurants)
-    - For each restaurant, include and format the answer as following, the number should range between 1-3:
-        introduction:
-        # number. The name of the restaurant as a large heading.
-        From **__** (number of UNIQUE review sources - don't count all) review(s), the critics say:
-        ##### _A description of the restaurant (no more than 5 sentences), do not consider google reviews comments_
-        ---
-        (if available)
-        Overall Google rating is **__** (rating) stars from **__** (userRatingCount) reviews\n
-        Average Google rating from last five reviews:  **__**\n
-        `A short and concise summarization of the last 5 google reviews, end by mentioning the relative latest review date (e.g: a week ago), no more than 3 lines`\n
-        ---
-        - Distance from the user’s location.
-        - Duration to get there.
-        - The transportation fare, skip this if the fare is None
-        - Address of the restaurant.
-        - The restaurant's instagram  (skip this line if their instagram is not available)
-        - After each restaurant insert a "<ig_placeholder>"
-    - Keep responses courteous and helpful, without making assumptions beyond the provided data.
-    - End by asking if the user would like to see other options or adjust their preferences, or to put the number of the restaurant they want to know more in detail.
-    """
-    
-    # prompt template, format the system message and user question
-    TEMPLATE = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            ("system", "Chat history: {chat_history}"),
-            ("system", "Here are the restaurants data: {restaurant}"),
-            # ("human", "User question: {input}"),
-        ]
-    )
-    prompt = TEMPLATE.format(chat_history= st.session_state.memories, restaurant=restaurant)
+        return
+
+    # Nothing new in the message, ask again for what the current state is waiting for
+    if not (turn.preference or turn.location):
+        off_topic_response('location' if st.session_state.state == 'location' else 'preference')
+        return
 
+    if not st.session_state.location:
+        answer = "\nNoted! Can you please tell me your starting point? It can be a specific address or an area."
+        st.session_state.memories.append({"role": "assistant", "content": answer})
+
+        with st.chat_message("assistant"):
+            st.write_stream(stream_data(answer))
+
+        st.session_state.state = 'location'
+        st.session_state.input = None
+        return
+
+    try:
+        st.session_state.lat, st.session_state.lng = get_geolocation(st.session_state.location)
+    except (IndexError, KeyError):
+        st.session_state.location = None
+        off_topic_response('location')
+        return
+    st.session_state.state = 'generate'
+
+
+@traced()
+def find_restaurants(preference, address):
     with st.spinner('Fetching information...'):
-        model = ChatOpenAI(model="gpt-4o")
-        response_text = model.invoke(prompt).content
-        st.session_state.memories.append({"role": "assistant", "content": response_text})
+        final_li = run(service.find_restaurants(preference, address, st.session_state.lat, st.session_state.lng))
 
-    return response_text
+    if is_far(final_li):
+        off_topic_response('far')
+        return False
+    else:
+        return final_li
 
 
-def generate_recommendations(context):
-    if st.session_state.options <= 2:
-        # Define the slice size
-        slice_size = 3
-        # Calculate the start and end positions based on the index and slice size
-        start = st.session_state.options * slice_size
-        end = start + slice_size
+@traced()
+def restaurant_summary(restaurants):
+    """
+    Prose for every restaurant on the page, prefetched while the previous page was read if possible.
+
+    Prose that is still missing is written now: the first missing card is returned to be streamed
+    on the script thread, the others are started on the engine as (indices, future).
+    """
+    prose = take(('prose', st.session_state.options)) or [None] * len(restaurants)
+    missing = [idx for idx, value in enumerate(prose) if value is None]
+    if not missing:
+        return prose, None, None
+
+    pending = None
+    if len(missing) > 1:
+        later = missing[1:]
+        pending = later, service.submit(service.generate_recommendations([restaurants[idx] for idx in later]), wait=service.ADMISSION_WAIT)
+    return prose, missing[0], pending
+
+
+def collect_prose(prose, pending):
+    # Prose written on the engine while the first card was streaming
+    later, future = pending
+    try:
+        values = future.result(timeout=service.JOB_TIMEOUT)
+    except Exception as e:
+        print(f"Writing the prose failed: {e!r}")
+        values = [None] * len(later)
+    for idx, value in zip(later, values):
+        prose[idx] = value or {}
+
+
+@traced()
+def stream_card(slot, number, restaurant):
+    # The card is shown straight away and its prose fills in as the tokens arrive
+    prose = {}
+    try:
+        for prose in stream_prose(get_chat_model(), restaurant):
+            slot.markdown(render_card(number, restaurant, prose))
+    except Exception as e:
+        print(f"Streaming the prose failed: {e!r}")
+    slot.markdown(render_card(number, restaurant, prose))
+    return prose
+
+
+@traced()
+def prefetch_next(context):
+    # Runs after a page is shown, warming what the user is most likely to ask for next
+    end = st.session_state.options * 3
+    for selected in context[end - 3:end]:
+        restaurant_dict = selected[next(iter(selected))]
+        schedule(('details', restaurant_dict['Place ID']), service.further_info(restaurant_dict))
+
+    next_page = context[end:end + 3]
+    if st.session_state.options <= 2 and next_page:
+        schedule(('prose', st.session_state.options), service.generate_recommendations(next_page))
 
-        restaurants = context[start:end]
-        ig_handle = [ig[next(iter(ig))]['Instagram'] for ig in restaurants]
-    
-        response_text = restaurant_summary(restaurants)
-        response_text_list = response_text.split('<ig_placeholder>')
 
+@traced()
+def generate_recommendations(context):
+    # Define the slice size
+    slice_size = 3
+    # Calculate the start and end positions based on the index and slice size
+    start = st.session_state.options * slice_size
+    end = start + slice_size
+    restaurants = context[start:end]
+
+    if st.session_state.options <= 2 and restaurants:
+        prose, streamed, pending = restaurant_summary(restaurants)
+
+        # Cards are rendered locally, the LLM only wrote the description and review summary
+        response_text_list = [INTRO]
+        embeds = []
         with st.chat_message("assistant"):
-            for idx, response in enumerate(response_text_list):
-                st.write_stream(stream_data(response))
-                try:
-                    if type(ig_handle[idx]) == str:
-                        st.components.v1.iframe(f"{ig_handle[idx].strip('/')}/embed/", height=380, scrolling=True)
-                except IndexError:
-                    pass
-        
-        if len(restaurants) > 0:
-            st.session_state.options += 1
+            st.write(INTRO)
+            for idx, restaurant in enumerate(restaurants):
+                if idx == streamed:
+                    prose[idx] = stream_card(st.empty(), idx + 1, restaurant)
+                elif prose[idx] is None and pending is not None:
+                    collect_prose(prose, pending)
+                    pending = None
+                card = render_card(idx + 1, restaurant, prose[idx] or {})
+                if idx != streamed:
+                    st.write(card)
+                response_text_list.append(card)
+
+                ig_handle = project_restaurant(restaurant)['instagram']
+                if ig_handle:
+                    embeds.append(f"{ig_handle.strip('/')}/embed/")
+                    st.components.v1.iframe(embeds[-1], height=380, scrolling=True)
+            st.write(OUTRO)
+        response_text_list.append(OUTRO)
+        st.session_state.memories.append({"role": "assistant", "content": "\n".join(response_text_list), "embeds": embeds})
+
+        st.session_state.options += 1
+        prefetch_next(context)
         st.session_state.state = 'continuation'
 
     else:
@@ -153,6 +187,33 @@ def generate_recommendations(context):
         st.session_state.options = 0
 
 
+def further_info_prompt(restaurant_info, metro_name, distance, duration):
+    system = f"""
+    You are a restaurant reviewer tasked with providing detailed information about a specific restaurant.
+
+    Instructions:
+    - Format your response clearly, professionally, and in a friendly tone, including all available data from the context.
+    - Avoid adding any information not explicitly provided in the context.
+    - Emphasize key details, presenting each piece of information on a new line for better readability.
+    - Display the restaurant name in a larger font.
+    - Do not prompt the user to ask for additional details.
+    - Include the nearest metro name, the distance by walking and estimated duration
+    - Conclude by informing the user they can view information about other restaurants by selecting a number, explore more options based on their preferences, or set new preferences.
+    """
+
+    # prompt template, format the system message and user question
+    TEMPLATE = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("system", "Here are the restaurants data: {restaurant_info}"),
+            ("system", "Here are the nearest metro: {metro_name}, distance: {distance}, and duration by walking: {duration}"),
+            # ("human", "User question: {input}"),
+        ]
+    )
+    return TEMPLATE.format(restaurant_info=restaurant_info, metro_name=metro_name, distance=distance, duration=duration)
+
+
+@traced()
 def further_info(context, number):
     with st.spinner('Fetching information...'):
         # Define the slice size
@@ -163,6 +224,9 @@ def further_info(context, number):
         end = start + slice_size
 
         try:
+            # A negative index would silently pick from the end of the page
+            if number < 1:
+                raise IndexError(number)
             selected = context[start:end][number-1]
 
         except IndexError:
@@ -172,39 +236,19 @@ def further_info(context, number):
         
         restaurant_dict = selected[next(iter(selected))]
 
-        metro_name, distance, duration = nearest_metro_walk(st.session_state.lat, st.session_state.lng, restaurant_dict['Address'])
-        restaurant_info = get_place_info(restaurant_dict['Place ID'])
-        
+        # Use the lookups prefetched while the page was read, fetch them now otherwise
+        details = take(('details', restaurant_dict['Place ID']))
+        if details is None or None in details:
+            details = run(service.further_info(restaurant_dict))
+        metro, place = details
 
-        system = f"""
-        You are a restaurant reviewer tasked with providing detailed information about a specific restaurant.
-
-        Instructions:
-        - Format your response clearly, professionally, and in a friendly tone, including all available data from the context.
-        - Avoid adding any information not explicitly provided in the context.
-        - Emphasize key details, presenting each piece of information on a new line for better readability.
-        - Display the restaurant name in a larger font.
-        - Do not prompt the user to ask for additional details.
-        - Include the nearest metro name, the distance by walking and estimated duration
-        - Conclude by informing the user they can view information about other restaurants by selecting a number, explore more options based on their preferences, or set new preferences.
-        """
-        
-        # prompt template, format the system message and user question
-        TEMPLATE = ChatPromptTemplate.from_messages(
-            [
-                ("system", system),
-                ("system", "Here are the restaurants data: {restaurant_info}"),
-                ("system", "Here are the nearest metro: {metro_name}, distance: {distance}, and duration by walking: {duration}"),
-                # ("human", "User question: {input}"),
-            ]
-        )
-        prompt = TEMPLATE.format( restaurant_info=restaurant_info, metro_name=metro_name, distance=distance, duration=duration)
-
-        # with st.spinner('Fetching information...'):
-        model = ChatOpenAI(model="gpt-4o")
-        response_text = model.invoke(prompt).content
-    
-    
-    st.session_state.memories.append({"role": "assistant", "content": response_text})
+        metro_name, distance, duration = metro or ('N/A', 'N/A', 'N/A')
+        restaurant_info = place or restaurant_dict
+
+
+        prompt = further_info_prompt(restaurant_info, metro_name, distance, duration)
+
+    model = get_chat_model()
     with st.chat_message("assistant"):
-        st.write_stream(stream_data(response_text))
\ No newline at end of file
+        response_text = st.write_stream(stream_tokens(model, prompt))
+    st.session_state.memories.append({"role": "assistant", "content": response_text})
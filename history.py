@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from cache import DAY
+
+# Older chat messages of every session, the file is local to the host like the cache
+HISTORY_PATH = os.environ.get('RESTAURANT_HISTORY_PATH', os.path.join('.cache', 'history.sqlite'))
+# Messages kept in session_state, one search with a page and a detail answer is about 9
+WINDOW = int(os.environ.get('RESTAURANT_HISTORY_WINDOW', 12))
+# Spilled messages kept per session, and how long the history of an idle session is kept
+MAX_SPILLED = 500
+HISTORY_TTL = DAY
+
+
+class SessionStore:
+    """SQLite table of the messages that no longer fit in a session's in-memory window."""
+
+    def __init__(self, path=HISTORY_PATH, max_spilled=MAX_SPILLED, ttl=HISTORY_TTL):
+        self.path = path
+        self.max_spilled = max_spilled
+        self.ttl = ttl
+        self.local = threading.local()
+
+    def _connection(self):
+        if self.path is None:
+            return None
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages (session TEXT, seq INTEGER, message TEXT, expires REAL, PRIMARY KEY (session, seq))")
+            self.local.conn = conn
+        return conn
+
+    def spill(self, session, first_seq, messages):
+        conn = self._connection()
+        if conn is None:
+            return
+        now = time.time()
+        rows = [(session, first_seq + i, json.dumps(message), now + self.ttl) for i, message in enumerate(messages)]
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows)
+                conn.execute("UPDATE messages SET expires = ? WHERE session = ?", (now + self.ttl, session))
+                conn.execute("DELETE FROM messages WHERE session = ? AND seq < ?", (session, first_seq + len(messages) - self.max_spilled))
+                conn.execute("DELETE FROM messages WHERE expires <= ?", (now,))
+        except sqlite3.Error as e:
+            print(f"History write failed: {e}")
+
+    def load(self, session, start, stop):
+        conn = self._connection()
+        if conn is None:
+            return []
+        try:
+            rows = conn.execute("SELECT message FROM messages WHERE session = ? AND seq >= ? AND seq < ? AND expires > ? ORDER BY seq",
+                                (session, start, stop, time.time())).fetchall()
+        except sqlite3.Error as e:
+            print(f"History read failed: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, session):
+        # Messages still stored, older ones may have been trimmed or expired
+        conn = self._connection()
+        if conn is None:
+            return 0
+        try:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE session = ? AND expires > ?", (session, time.time())).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"History read failed: {e}")
+            return 0
+
+
+session_store = SessionStore()
+
+
+class History:
+    """
+    Chat history of one session: the latest messages in memory, older ones in the session store.
+
+    Iterating yields the in-memory window only, earlier() reads the spilled messages back.
+    Only the session id and the window are pickled with session_state.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.session = uuid.uuid4().hex
+        self.window = window
+        self.recent = []
+        self.spilled = 0
+
+    def append(self, message):
+        self.recent.append(message)
+        if len(self.recent) > self.window:
+            # Spill down to half the window, so the store is written once every few turns
+            overflow = len(self.recent) - self.window // 2
+            session_store.spill(self.session, self.spilled, self.recent[:overflow])
+            self.spilled += overflow
+            self.recent = self.recent[overflow:]
+
+    def stored(self):
+        # self.spilled numbers the messages, this is how many of them can still be read back
+        return session_store.count(self.session) if self.spilled else 0
+
+    def earlier(self, limit=None):
+        start = 0 if limit is None else max(0, self.spilled - limit)
+        return session_store.load(self.session, start, self.spilled)
+
+    def __iter__(self):
+        return iter(self.recent)
+
+    def __len__(self):
+        return self.spilled + len(self.recent)
@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+from collections import Counter
+import numpy as np
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+# Below this confidence read_turn asks the LLM instead
+CONFIDENCE_THRESHOLD = 0.8
+
+# Set INTENT_EMBEDDINGS=1 to try prototype similarity before falling back to the LLM
+USE_EMBEDDINGS = os.environ.get('INTENT_EMBEDDINGS') == '1'
+SIMILARITY_THRESHOLD = 0.88
+
+ORDINALS = {
+    'one': 1, 'first': 1, '1st': 1,
+    'two': 2, 'second': 2, '2nd': 2,
+    'three': 3, 'third': 3, '3rd': 3,
+}
+
+OTHER_PATTERN = re.compile(
+    r"^(yes|yeah|yep|yup|y|sure|ok|okay|please|more|other|others|another|next|"
+    r"(yes,? )?(show|give|see)( me)? (some )?more( options)?|more (options|please)|"
+    r"(show|see|give)( me)? (other|another|the next)( ones?| options?| restaurants?)?|"
+    r"(other|another|next|more) (ones?|options?|restaurants?|places?)|"
+    r"yes,? please|sure,? (why not|go ahead)|go ahead)$"
+)
+# Only bare requests to start over, a message that names a new preference or location is read by the LLM
+PREFERENCE_PATTERN = re.compile(
+    r"^(?:(?:i want to|i'd like to|let me|can i) )?(?:change|new|adjust|update|reset|set) (?:my |the )?(?:preferences?|search)(?: please)?$|"
+    r"^(?:new|different) (?:preferences?|search)(?: please)?$|^start (?:over|again)$"
+)
+# Words of a message that changes the search rather than picking from the page
+CHANGE_PATTERN = re.compile(r"\b(change|new|adjust|update|different|switch|set|instead)\b")
+# A page lists three restaurants, other numbers and counts such as "for 2 people" are left to the LLM
+NUMBER_PATTERN = re.compile(r"^(?:(?:number|no\.?|option|restaurant|#)\s*)?([1-3])$")
+MENTIONED_NUMBER_PATTERN = re.compile(
+    r"(?:\b(?:number|no\.?|option|restaurant)|#)\s*([1-3]|one|two|three)\b|"
+    r"\babout (?:the )?([1-3])\b|\b(first|second|third|1st|2nd|3rd)\b"
+)
+
+PROTOTYPES = {
+    'other': ["yes", "show me more options", "other restaurants please"],
+    'preference': ["change my preferences", "I want something different", "set a new preference"],
+}
+
+metrics = Counter()
+metrics_lock = threading.Lock()
+
+
+def record(source):
+    with metrics_lock:
+        metrics[source] += 1
+
+
+def fallback_rate():
+    # Share of replies that still needed the LLM
+    with metrics_lock:
+        total = sum(metrics.values())
+        return metrics['llm'] / total if total else 0.0
+
+
+def classify_rules(text):
+    """Returns (label, confidence), the label is 'other', 'preference', 'neither' or a number."""
+    text = re.sub(r"[!?.,]+$", "", text.strip().lower())
+    text = re.sub(r"\s+", " ", text)
+    if not text:
+        return 'neither', 0.0
+
+    number = NUMBER_PATTERN.match(text)
+    if number:
+        return number.group(1), 1.0
+
+    if OTHER_PATTERN.match(text):
+        return 'other', 0.95
+
+    if PREFERENCE_PATTERN.match(text):
+        return 'preference', 0.9
+
+    # A single short mention such as "tell me about the second one" selects that restaurant
+    mentioned = MENTIONED_NUMBER_PATTERN.findall(text)
+    if len(mentioned) == 1 and not CHANGE_PATTERN.search(text) and len(text.split()) <= 8:
+        number = next(group for group in mentioned[0] if group)
+        return str(ORDINALS.get(number, number)), 0.85
+
+    return 'neither', 0.0
+
+
+def classify_embeddings(text, embeddings):
+    query = np.asarray(embeddings.embed_query(text), dtype=float)
+    best_label, best_similarity = 'neither', 0.0
+    for label, examples in PROTOTYPES.items():
+        for example in examples:
+            vector = np.asarray(embeddings.embed_query(example), dtype=float)
+            similarity = float(query @ vector / (np.linalg.norm(query) * np.linalg.norm(vector)))
+            if similarity > best_similarity:
+                best_label, best_similarity = label, similarity
+    return best_label, best_similarity
+
+
+def classify_response(text, embeddings=None):
+    """
+    Local fast path for replies to a page of recommendations, returns the label or None when the LLM should decide.
+    """
+    label, confidence = classify_rules(text)
+    if confidence >= CONFIDENCE_THRESHOLD:
+        record('rules')
+        return label
+
+    if USE_EMBEDDINGS and embeddings is not None:
+        label, similarity = classify_embeddings(text, embeddings)
+        if similarity >= SIMILARITY_THRESHOLD:
+            record('embeddings')
+            return label
+
+    record('llm')
+    return None
+
+
+class Turn(BaseModel):
+    """What one user message asks for, extracted in a single structured LLM call."""
+
+    intent: Literal['preference', 'location', 'other', 'number', 'neither'] = Field(
+        description="preference: states or changes a food, dietary or restaurant preference. "
+                    "location: only gives or changes the starting point. "
+                    "other: agrees or wants other options. "
+                    "number: picks one of the listed restaurants. "
+                    "neither: unrelated to dining or not understandable."
+    )
+    preference: Optional[str] = Field(None, description="The complete updated dining preference, or null if the message does not change it.")
+    location: Optional[str] = Field(None, description="The starting point without filler words such as 'near', 'to' or 'in', or null if not mentioned.")
+    number: Optional[int] = Field(None, description="The number of the restaurant the user picked, or null.")
+
+
+def turn_from_label(label):
+    # Rule and embedding labels carry no preference or location text
+    if label.isdigit():
+        return Turn(intent='number', number=int(label))
+    return Turn(intent=label)
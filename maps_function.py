@@ -1,11 +1,48 @@
 import streamlit as st
 import requests
-from utils import off_topic_response
+from requests.adapters import HTTPAdapter
+from utils import retry_on_failure
+from cache import cached, maps_cache, TTL
+from geo import within_radius, MAX_DISTANCE_KM
+from stations import load_station_index
+from ratelimit import acquire
+from tracing import traced, record_upstream
 import json
 import numpy as np
 
 gmap_api = st.secrets['GOOGLE_API_KEY']
 
+# Shared connection pool for all Google calls, sized for the request engine workers
+MAX_WORKERS = 16
+REQUEST_TIMEOUT = 10
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+
+def is_transient(exception):
+    # Throttling, server errors and dropped connections are worth retrying, other HTTP errors are not
+    if isinstance(exception, requests.HTTPError) and exception.response is not None:
+        status = exception.response.status_code
+        return status == 429 or status >= 500 or 'OVER_QUERY_LIMIT' in exception.args
+    return isinstance(exception, requests.RequestException)
+
+
+@traced()
+@retry_on_failure(retries=3, delay=1, retry_if=is_transient)
+def request_json(method, url, **kwargs):
+    acquire('google')
+    record_upstream('google')
+    response = session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+    # Error bodies are never returned as data, so a failed lookup is never cached
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict) and data.get('status') == 'OVER_QUERY_LIMIT':
+        raise requests.HTTPError('OVER_QUERY_LIMIT', response=response)
+    return data
+
+@traced()
+@cached('geocode')
 def get_geolocation(address):
     geocoding_url = "https://maps.googleapis.com/maps/api/geocode/json?"
 
@@ -16,8 +53,7 @@ def get_geolocation(address):
         "components": "locality:london|country:GB",
         "key": gmap_api, # Replace with your actual API key
     }
-    response = requests.get(geocoding_url, params=params)
-    geodata=response.json()
+    geodata = request_json("GET", geocoding_url, params=params)
 
     latitude = geodata['results'][0]['geometry']['location']['lat']
     longitude = geodata['results'][0]['geometry']['location']['lng']
@@ -25,6 +61,8 @@ def get_geolocation(address):
     return (latitude, longitude)
 
 
+@traced()
+@cached('place_info')
 def get_place_info(place_id):
     url = f"https://places.googleapis.com/v1/places/{place_id}"
 
@@ -39,7 +77,7 @@ def get_place_info(place_id):
         "key": gmap_api
     }
 
-    response = requests.get(url, params=params, headers=headers).json()
+    response = request_json("GET", url, params=params, headers=headers)
 
     restaurant_data = {}
     restaurant_data['restaurant'] = response.get('displayName', {}).get('text', 'N/A')  # Handles missing 'displayName' or 'text'
@@ -54,6 +92,8 @@ def get_place_info(place_id):
 
     return restaurant_data
 
+@traced()
+@cached('walking_distance')
 def get_distance(start, end):
     # Define the base URL and parameters
     base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
@@ -67,7 +107,7 @@ def get_distance(start, end):
     }
 
     # Make the request
-    response = requests.get(base_url, params=params).json()
+    response = request_json("GET", base_url, params=params)
 
     try:
         distance = response['rows'][0]['elements'][0]['distance']['text']
@@ -75,19 +115,20 @@ def get_distance(start, end):
         return distance, duration
 
     except KeyError:
-        off_topic_response('location')
-        return False
+        # Runs on engine threads without a session, the caller decides what the user sees
+        return None
     
 
-def nearest_metro_walk(latitude, longitude, destination):
+@traced()
+def find_nearest_station(latitude, longitude, radius=1000):
     # Define the URL
     url = "https://places.googleapis.com/v1/places:searchNearby"
 
-    # Define the headers
+    # Define the headers, only the fields used below
     headers = {
         "Content-Type": "application/json",
         "X-Goog-Api-Key": gmap_api, 
-        "X-Goog-FieldMask": "*"
+        "X-Goog-FieldMask": "places.displayName,places.formattedAddress,places.location"
     }
 
     # Define the data payload
@@ -99,20 +140,50 @@ def nearest_metro_walk(latitude, longitude, destination):
         "center": {
             "latitude": latitude,
             "longitude": longitude},
-        "radius": 1000
+        "radius": radius
         }
     }
     }
 
     # Make the POST request
-    response = requests.post(url, headers=headers, json=data)
-    nearest_subway_name = response.json()['places'][0]['displayName']
-    nearest_subway_address = response.json()['places'][0]['formattedAddress']
-    distance, duration = get_distance(nearest_subway_address, destination)
-
-    return nearest_subway_name, distance, duration
+    response = request_json("POST", url, headers=headers, json=data)
+    place = response['places'][0]
+    return {
+        'name': place['displayName']['text'],
+        'address': place['formattedAddress'],
+        'lat': place['location']['latitude'],
+        'lng': place['location']['longitude'],
+    }
 
 
+@traced()
+@cached('nearest_metro')
+def nearest_metro_walk(latitude, longitude, destination):
+    # A known station from the bundled index saves the Places search
+    index = load_station_index()
+    station = index.nearest(latitude, longitude)
+    if station is None:
+        station = find_nearest_station(latitude, longitude)
+    walk = get_distance(station['address'], destination)
+    if walk is None:
+        return None
+    distance, duration = walk
+
+    return station['name'], distance, duration
+
+
+@traced()
+def nearest_station_walk(place_id, latitude, longitude, destination):
+    # Precomputed per restaurant, only restaurants missing from the index go to Google
+    known = load_station_index().lookup(place_id)
+    if known is not None:
+        return known
+    # The docstore holds some coordinates as strings, cast them before the math and the cache key
+    return nearest_metro_walk(float(latitude), float(longitude), destination)
+
+
+@traced()
+@cached('google_reviews')
 def get_google_reviews(place_id):
     url = f"https://places.googleapis.com/v1/places/{place_id}"
 
@@ -127,69 +198,135 @@ def get_google_reviews(place_id):
         "key": gmap_api,  # Replace with your actual API key
     }
 
-    response = requests.get(url, params=params, headers=headers).json()
+    response = request_json("GET", url, params=params, headers=headers)
     
-    reviews_data = response['reviews']
-    reviews = [{'rating': i['rating'], 'text': i['text']['text'], 'published': i['publishTime'].split('T')[0]} for i in reviews_data]
+    # request_json raised on error bodies, so a missing field here means a place without reviews
+    reviews_data = response.get('reviews', [])
+    reviews = [{'rating': i['rating'], 'text': i.get('text', {}).get('text', ''), 'published': i['publishTime'].split('T')[0]} for i in reviews_data]
 
     # turn dictionary to string
     # return [json.dumps(dictionary, ensure_ascii=False) for dictionary in reviews]
-    return response['rating'], response['userRatingCount'], reviews
-
-
-def get_distance_and_review(address, context):
-    with st.spinner('Fetching information...'):
-        final_li = []
-        for doc in context:
-            try:
-                context_dict = json.loads(dict(doc[0])['page_content'])
-                rest_address = context_dict[next(iter(context_dict))]['Address']
-                place_id = context_dict[next(iter(context_dict))]['Place ID']
-            except KeyError:
-                continue
-            
-            context_dict['score'] = doc[1]
-
-            # Define the base URL and parameters
-            base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-
-            # Define the parameters
-            params = {
-                "destinations": rest_address,
-                "origins": address if 'london' in address.lower() else address + ', London',
-                "key": gmap_api,
-                "mode": 'transit',
-                'transit_mode': 'subway'
-            }
-
-            # Make the request
-            response = requests.get(base_url, params=params).json()
-
-
-            distance_text = response['rows'][0]['elements'][0].get('distance', {}).get('text', 'NA')
-            if distance_text != 'NA':
-                # Convert distance to a numeric value (assuming it's in km or m format)
-                distance_value = float(distance_text.split()[0])  # Extract numeric part of distance
-                
-                # Keep only entries with distance <= 2 km
-                if distance_value <= 3:
-                    context_dict['distance'] = distance_text
-                    context_dict['duration'] = response['rows'][0]['elements'][0].get('duration', {}).get('text', 'NA')
-                    context_dict['fare'] = response['rows'][0]['elements'][0].get('fare', {}).get('text', None)
-                    
-                    # Fetch Google reviews
-                    try:
-                        context_dict['total_rating'], context_dict['rating_counts'], context_dict['google_reviews'] = get_google_reviews(place_id)
-                    except:
-                        context_dict['total_rating'], context_dict['rating_counts'], context_dict['google_reviews'] = 'NA', 'NA', 'NA'
-                    
-                    final_li.append(context_dict)
-           
+    return response.get('rating', 'NA'), response.get('userRatingCount', 0), reviews
+
+
+@traced()
+def get_transit_distances(origin, destinations, chunk_size=25):
+    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+    # Serve known origin/destination pairs from the cache, only request the rest
+    elements = [None] * len(destinations)
+    missing = []
+    for idx, destination in enumerate(destinations):
+        found, element = maps_cache.get('transit_distance', json.dumps([origin, destination]))
+        if found:
+            elements[idx] = element
+        else:
+            missing.append(idx)
+
+    # The Distance Matrix API accepts up to 25 destinations per request
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+
+        # Define the parameters
+        params = {
+            "destinations": "|".join(destinations[idx] for idx in chunk),
+            "origins": origin,
+            "key": gmap_api,
+            "mode": 'transit',
+            'transit_mode': 'subway'
+        }
+
+        # Make the request, one row per origin and one element per destination
+        response = request_json("GET", base_url, params=params)
+        try:
+            chunk_elements = response['rows'][0]['elements']
+        except (KeyError, IndexError):
+            chunk_elements = []
+
+        # Unmatched destinations keep an empty element so they are filtered out downstream
+        for j, idx in enumerate(chunk):
+            element = chunk_elements[j] if j < len(chunk_elements) else {}
+            elements[idx] = element
+            if element.get('status') == 'OK':
+                maps_cache.set('transit_distance', json.dumps([origin, destinations[idx]]), element, TTL['transit_distance'])
+
+    return elements
+
+
+@traced()
+def find_nearby(address, context, lat, lng):
+    # Drop restaurants that are too far in a straight line before paying for transit lookups
+    nearby_mask = within_radius(lat, lng, [doc[0] for doc in context])
+    context = [doc for doc, keep in zip(context, nearby_mask) if keep]
+
+    candidates = []
+    for doc in context:
+        try:
+            context_dict = json.loads(dict(doc[0])['page_content'])
+            rest_address = context_dict[next(iter(context_dict))]['Address']
+            place_id = context_dict[next(iter(context_dict))]['Place ID']
+        except KeyError:
+            continue
+        
+        context_dict['score'] = doc[1]
+        candidates.append((context_dict, rest_address, place_id))
+
+    return add_transit(address, candidates)
+
+
+def add_transit(address, candidates):
+    # Distance, duration and fare from this origin, candidates beyond MAX_DISTANCE_KM by transit are dropped
+    origin = address if 'london' in address.lower() else address + ', London'
+    elements = get_transit_distances(origin, [rest_address for _, rest_address, _ in candidates])
+
+    nearby = []
+    for (context_dict, rest_address, place_id), element in zip(candidates, elements):
+        distance_text = element.get('distance', {}).get('text', 'NA')
+        if distance_text != 'NA':
+            # Convert distance to a numeric value (assuming it's in km or m format)
+            distance_value = float(distance_text.split()[0])  # Extract numeric part of distance
             
+            # Keep only entries with distance <= 3 km
+            if distance_value <= MAX_DISTANCE_KM:
+                context_dict['distance'] = distance_text
+                context_dict['duration'] = element.get('duration', {}).get('text', 'NA')
+                context_dict['fare'] = element.get('fare', {}).get('text', None)
+                nearby.append((context_dict, place_id))
+    return nearby
+
+
+# Fields of an enriched restaurant that depend on where the user starts from
+ORIGIN_FIELDS = ('distance', 'duration', 'fare')
+
+
+def without_origin(final_li):
+    return [{key: value for key, value in context_dict.items() if key not in ORIGIN_FIELDS} for context_dict in final_li]
+
+
+@traced()
+def with_origin(address, final_li):
+    # A cached candidate list gets the per-origin fields of this user's own starting point
+    candidates = []
+    for context_dict in final_li:
+        restaurant = context_dict[next(iter(context_dict))]
+        candidates.append((context_dict, restaurant['Address'], restaurant['Place ID']))
+    return [context_dict for context_dict, _ in add_transit(address, candidates)]
+
+
+@traced()
+def attach_reviews(nearby, reviews):
+    # reviews holds one {'ok', 'value'|'error'} result per nearby restaurant, in the same order
+    final_li = []
+    for (context_dict, place_id), result in zip(nearby, reviews):
+        if result['ok']:
+            context_dict['total_rating'], context_dict['rating_counts'], context_dict['google_reviews'] = result['value']
+        else:
+            context_dict['total_rating'], context_dict['rating_counts'], context_dict['google_reviews'] = 'NA', 'NA', 'NA'
+        final_li.append(context_dict)
+    return final_li
+
+
+@traced()
+def is_far(final_li):
     # Check the average distance and determine if the response is on-topic
-    if not final_li or np.mean([float(str(i['distance']).split()[0]) for i in final_li]) > 50:
-        off_topic_response('far')
-        return False
-    else:
-        return final_li
-    
\ No newline at end of file
+    return not final_li or np.mean([float(str(i['distance']).split()[0]) for i in final_li]) > 50
@@ -0,0 +1,203 @@
+"""
+Offline build steps for the restaurant vector store.
+
+Usage:
+    python precompute.py coords [--db faiss_db]
+    python precompute.py export [--db faiss_db] [--out restaurant_index]
+    python precompute.py stations [--db faiss_db] [--stations london_stations.csv] [--out faiss_db/nearest_stations.json]
+    python precompute.py summaries [--db faiss_db] [--out faiss_db/critic_summaries.json]
+"""
+import argparse
+import csv
+import json
+import os
+from collections import defaultdict
+import numpy as np
+
+from langchain_community.vectorstores import FAISS
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+
+from geo import haversine_km
+from stations import STATION_INDEX_PATH
+from summaries import CRITIC_SUMMARIES_PATH, reviews_hash, summarize_critics
+from vector_store import export_store
+
+
+def load_store(path):
+    return FAISS.load_local(path, OpenAIEmbeddings(), allow_dangerous_deserialization=True)
+
+
+def iter_restaurants(faiss_db):
+    # (document, restaurant fields) for every parseable document in the store
+    for doc in faiss_db.docstore._dict.values():
+        try:
+            content = json.loads(doc.page_content)
+            yield doc, content[next(iter(content))]
+        except (ValueError, TypeError, StopIteration):
+            continue
+
+
+def precompute_coordinates(path):
+    # Copy every restaurant's coordinates and Place ID into the document metadata
+    faiss_db = load_store(path)
+    updated = 0
+    for doc, restaurant in iter_restaurants(faiss_db):
+        try:
+            doc.metadata['latitude'] = float(restaurant['Latitude'])
+            doc.metadata['longitude'] = float(restaurant['Longitude'])
+            doc.metadata['place_id'] = restaurant['Place ID']
+            updated += 1
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    faiss_db.save_local(path)
+    print(f"Stored coordinates for {updated} of {len(faiss_db.docstore._dict)} restaurants in {path}")
+
+
+def export_index(path, out):
+    faiss_db = load_store(path)
+    export_store(faiss_db, out)
+    print(f"Exported {faiss_db.index.ntotal} restaurants from {path} to {out}")
+
+
+def read_stations(stations_csv):
+    # Expects name, latitude and longitude columns, address is optional
+    with open(stations_csv, newline='') as f:
+        return [
+            {
+                'name': row['name'],
+                'address': row.get('address') or f"{row['latitude']},{row['longitude']}",
+                'lat': float(row['latitude']),
+                'lng': float(row['longitude']),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def precompute_stations(path, stations_csv, out):
+    # Needs the Google key from .streamlit/secrets.toml
+    from maps_function import find_nearest_station, request_json, gmap_api
+
+    restaurants = []
+    for _, restaurant in iter_restaurants(load_store(path)):
+        try:
+            restaurants.append((restaurant['Place ID'], float(restaurant['Latitude']), float(restaurant['Longitude']), restaurant['Address']))
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    if stations_csv:
+        stations = read_stations(stations_csv)
+    else:
+        # Without a station list, collect the stations Google reports next to each restaurant
+        found = {}
+        for _, lat, lng, _ in restaurants:
+            try:
+                station = find_nearest_station(lat, lng)
+            except (KeyError, IndexError):
+                continue
+            found.setdefault(station['address'], station)
+        stations = list(found.values())
+
+    lats = np.array([station['lat'] for station in stations])
+    lngs = np.array([station['lng'] for station in stations])
+
+    # Group the restaurants by their nearest station so each station needs one walking request per 25 restaurants
+    by_station = defaultdict(list)
+    for place_id, lat, lng, address in restaurants:
+        by_station[int(np.argmin(haversine_km(lat, lng, lats, lngs)))].append((place_id, address))
+
+    index = {}
+    for station, members in by_station.items():
+        for i in range(0, len(members), 25):
+            chunk = members[i:i + 25]
+            params = {
+                "origins": stations[station]['address'],
+                "destinations": "|".join(address for _, address in chunk),
+                "key": gmap_api,
+                "mode": 'walking'
+            }
+            response = request_json("GET", "https://maps.googleapis.com/maps/api/distancematrix/json", params=params)
+            try:
+                elements = response['rows'][0]['elements']
+            except (KeyError, IndexError):
+                elements = []
+
+            for j, (place_id, _) in enumerate(chunk):
+                element = elements[j] if j < len(elements) else {}
+                index[place_id] = {
+                    'station': station,
+                    'distance': element.get('distance', {}).get('text'),
+                    'duration': element.get('duration', {}).get('text'),
+                }
+
+    with open(out, 'w') as f:
+        json.dump({'stations': stations, 'restaurants': index}, f, ensure_ascii=False)
+    print(f"Indexed the nearest of {len(stations)} stations for {len(index)} restaurants in {out}")
+
+
+def precompute_summaries(path, out, model_name='gpt-4o', save_every=50):
+    # Incremental: restaurants whose critic reviews did not change keep their summary
+    summaries = {}
+    if os.path.exists(out):
+        with open(out) as f:
+            summaries = json.load(f)
+
+    model = ChatOpenAI(model=model_name)
+    written = 0
+    for doc, restaurant in iter_restaurants(load_store(path)):
+        try:
+            place_id = restaurant['Place ID']
+            reviews = restaurant['Reviews']
+        except KeyError:
+            continue
+
+        content_hash = reviews_hash(reviews)
+        if summaries.get(place_id, {}).get('hash') == content_hash:
+            continue
+
+        name = next(iter(json.loads(doc.page_content)))
+        summaries[place_id] = {
+            'hash': content_hash,
+            'description': summarize_critics(model, name, reviews),
+        }
+        written += 1
+
+        # Save progress regularly so an interrupted build can resume
+        if written % save_every == 0:
+            with open(out, 'w') as f:
+                json.dump(summaries, f, ensure_ascii=False)
+
+    with open(out, 'w') as f:
+        json.dump(summaries, f, ensure_ascii=False)
+    print(f"Summarized {written} restaurants, {len(summaries)} summaries in {out}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    coords = subparsers.add_parser('coords', help='store restaurant coordinates in the docstore metadata')
+    coords.add_argument('--db', default='faiss_db')
+
+    export = subparsers.add_parser('export', help='write the store in the memory-mappable, pickle-free format')
+    export.add_argument('--db', default='faiss_db')
+    export.add_argument('--out', default='restaurant_index')
+
+    stations = subparsers.add_parser('stations', help='index every restaurant\'s nearest station and walking time')
+    stations.add_argument('--db', default='faiss_db')
+    stations.add_argument('--stations', help='CSV with name, latitude, longitude (and optional address) columns')
+    stations.add_argument('--out', default=STATION_INDEX_PATH)
+
+    summaries = subparsers.add_parser('summaries', help='summarize every restaurant\'s critic reviews once, offline')
+    summaries.add_argument('--db', default='faiss_db')
+    summaries.add_argument('--out', default=CRITIC_SUMMARIES_PATH)
+
+    args = parser.parse_args()
+    if args.command == 'coords':
+        precompute_coordinates(args.db)
+    elif args.command == 'export':
+        export_index(args.db, args.out)
+    elif args.command == 'stations':
+        precompute_stations(args.db, args.stations, args.out)
+    elif args.command == 'summaries':
+        precompute_summaries(args.db, args.out)
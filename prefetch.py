@@ -0,0 +1,47 @@
+import streamlit as st
+
+from service import submit, ServiceBusy
+from ratelimit import background
+
+
+def get_jobs():
+    if 'prefetch_jobs' not in st.session_state:
+        st.session_state.prefetch_jobs = {}
+    return st.session_state.prefetch_jobs
+
+
+def schedule(key, coro):
+    """
+    Starts a request engine coroutine in the background unless the same key is already pending.
+
+    Speculative work never queues, it is simply skipped when the engine is saturated,
+    and it runs at background priority so it cannot spend the budget kept for user turns.
+    """
+    jobs = get_jobs()
+    if key in jobs:
+        coro.close()
+        return
+    try:
+        jobs[key] = submit(background(coro))
+    except ServiceBusy:
+        coro.close()
+
+
+def take(key, timeout=30):
+    # Result of a prefetched job, or None if it was never scheduled, was cancelled or failed
+    future = get_jobs().pop(key, None)
+    if future is None or future.cancelled():
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        print(f"Prefetch {key} failed: {e!r}")
+        return None
+
+
+def cancel_all():
+    # Drop speculative work that no longer matches the conversation
+    jobs = get_jobs()
+    for future in jobs.values():
+        future.cancel()
+    jobs.clear()
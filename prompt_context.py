@@ -0,0 +1,142 @@
+import json
+from datetime import date
+from functools import lru_cache
+import numpy as np
+import tiktoken
+from langchain_core.prompts import ChatPromptTemplate
+
+# Upper bound for the restaurants part of the summary prompt
+RESTAURANT_TOKEN_BUDGET = 2500
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    # gpt-4o's tokenizer, the ranks file is downloaded once and then cached by tiktoken
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Tokenizer unavailable, estimating tokens from characters: {e!r}")
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = get_encoding()
+    if encoding is None:
+        return text if len(text) <= max_tokens * 4 else text[:max_tokens * 4] + "..."
+
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "..."
+
+
+def relative_date(published, today=None):
+    try:
+        days = ((today or date.today()) - date.fromisoformat(published)).days
+    except (TypeError, ValueError):
+        return 'N/A'
+
+    if days < 1:
+        return 'today'
+    if days < 7:
+        return f"{days} day{'s' if days > 1 else ''} ago"
+    if days < 30:
+        return f"{days // 7} week{'s' if days >= 14 else ''} ago"
+    if days < 365:
+        return f"{days // 30} month{'s' if days >= 60 else ''} ago"
+    return f"{days // 365} year{'s' if days >= 730 else ''} ago"
+
+
+def project_restaurant(context_dict):
+    """
+    Keeps only the fields the summary template uses and precomputes the aggregates it asks for.
+    """
+    name = next(iter(context_dict))
+    restaurant = context_dict[name]
+    critic_reviews = restaurant.get('Reviews', [])
+
+    google_reviews = context_dict.get('google_reviews')
+    if not isinstance(google_reviews, list):
+        google_reviews = []
+    latest_reviews = google_reviews[:5]
+    ratings = [review['rating'] for review in latest_reviews if isinstance(review.get('rating'), (int, float))]
+    published = max((review.get('published', '') for review in latest_reviews), default=None)
+
+    return {
+        'name': name,
+        'unique_review_sources': len({review.get('source') for review in critic_reviews}),
+        'critic_reviews': [review.get('text', '') for review in critic_reviews],
+        'google_rating': context_dict.get('total_rating', 'NA'),
+        'google_rating_count': context_dict.get('rating_counts', 'NA'),
+        'average_rating_last_five': round(float(np.mean(ratings)), 1) if ratings else 'NA',
+        'google_reviews': [review.get('text', '') for review in latest_reviews],
+        'latest_review': relative_date(published) if published else 'N/A',
+        'distance': context_dict.get('distance'),
+        'duration': context_dict.get('duration'),
+        'fare': context_dict.get('fare'),
+        'address': restaurant.get('Address'),
+        'instagram': restaurant.get('Instagram') if restaurant.get('Instagram') not in (None, 'None', 'N/A') else None,
+    }
+
+
+def build_restaurant_context(restaurants, budget=RESTAURANT_TOKEN_BUDGET, exclude=()):
+    """
+    Projects the restaurants and shortens their review texts until the JSON fits the token budget.
+    """
+    projected = [project_restaurant(restaurant) for restaurant in restaurants]
+    for restaurant in projected:
+        for field in exclude:
+            restaurant[field] = []
+
+    text = json.dumps(projected, ensure_ascii=False)
+    # Halve the allowance per review until the prompt fits, critic text first since it is the longest
+    limit = 400
+    while count_tokens(text) > budget and limit >= 25:
+        for restaurant in projected:
+            restaurant['critic_reviews'] = [truncate_tokens(review, limit) for review in restaurant['critic_reviews']]
+            restaurant['google_reviews'] = [truncate_tokens(review, limit // 2) for review in restaurant['google_reviews']]
+        text = json.dumps(projected, ensure_ascii=False)
+        limit //= 2
+    return text
+
+
+STATE_DESCRIPTIONS = {
+    'prepare': "asking for the user's dining preferences",
+    'location': "asking for the user's starting point",
+    'continuation': "showing a numbered list of recommended restaurants",
+}
+
+
+def turn_prompt(state, input, preference=None, location=None):
+    system = """
+        You read one message of a user talking to a London restaurant recommendation assistant.
+
+        The assistant is currently {state}.
+        Current dining preference: {preference}
+        Current starting point: {location}
+
+        Instructions:
+        - Decide the intent of the message.
+        - Rephrase the user's restaurant or food preference into a clear and concise statement, removing filler words and keeping only relevant information.
+        - Prioritize food preference/allergy, put additional information in a bracket. example: vegan restaurant (family-friendly)
+        - When the message adds to the current preference, return the combined preference.
+        - The location should be cleaned, meaning it should be stripped of filler words such as 'near', 'to', 'in', etc
+        - Only return a number when the user picks one of the listed restaurants.
+        """
+
+    # prompt template, format the system message and user question
+    TEMPLATE = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "User message: {input}"),
+        ]
+      )
+    return TEMPLATE.format(state=STATE_DESCRIPTIONS.get(state, STATE_DESCRIPTIONS['prepare']), preference=preference or 'none yet',
+                           location=location or 'none yet', input=input)
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import fcntl
+import asyncio
+import threading
+import contextvars
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# Bucket state lives in small files so every worker process on the host shares one budget
+RATE_LIMIT_DIR = os.environ.get('RESTAURANT_RATE_LIMIT_DIR', os.path.join('.cache', 'ratelimit'))
+
+# Requests per second and burst size per upstream API
+RATES = {
+    'openai': (float(os.environ.get('OPENAI_RPS', 8)), 16),
+    'google': (float(os.environ.get('GOOGLE_RPS', 50)), 100),
+}
+
+# Share of the bucket background work must leave untouched for interactive calls
+BACKGROUND_RESERVE = 0.5
+
+# 'interactive' or 'background', set per task so prefetch jobs yield to user turns
+priority = contextvars.ContextVar('priority', default='interactive')
+
+
+class TokenBucket:
+    """
+    Token bucket shared across threads and processes through a locked state file.
+    """
+
+    def __init__(self, name, rate, capacity, directory=RATE_LIMIT_DIR):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = os.path.join(directory, f"{name}.json")
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self, reserve=0):
+        # Takes a token and returns 0, or returns the seconds to wait before trying again
+        with self.lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+
+                now = time.time()
+                tokens = min(self.capacity, state.get('tokens', self.capacity) + (now - state.get('updated', now)) * self.rate)
+                if tokens >= 1 + reserve:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 + reserve - tokens) / self.rate
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({'tokens': tokens, 'updated': now}))
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve(self):
+        return self.capacity * BACKGROUND_RESERVE if priority.get() == 'background' else 0
+
+    def acquire(self, blocking=True):
+        while True:
+            wait = self.try_acquire(self.reserve())
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, blocking=True):
+        # The file lock can block under contention, keep it off the shared event loop
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, self.reserve())
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(wait)
+
+
+class SharedRateLimiter(BaseRateLimiter):
+    """LangChain rate limiter backed by a shared TokenBucket, for ChatOpenAI(rate_limiter=...)."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def acquire(self, *, blocking=True):
+        return self.bucket.acquire(blocking=blocking)
+
+    async def aacquire(self, *, blocking=True):
+        return await self.bucket.aacquire(blocking=blocking)
+
+
+buckets = {}
+buckets_lock = threading.Lock()
+
+
+def get_bucket(api):
+    with buckets_lock:
+        if api not in buckets:
+            rate, capacity = RATES[api]
+            buckets[api] = TokenBucket(api, rate, capacity)
+        return buckets[api]
+
+
+def acquire(api):
+    return get_bucket(api).acquire()
+
+
+async def background(coro):
+    # Runs a coroutine at background priority, the setting stays inside its own task
+    priority.set('background')
+    return await coro
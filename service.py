@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as JobTimeout
+import openai
+import requests
+
+from utils import get_chat_model, get_embeddings, get_turn_reader, get_context as search_context
+from cache import page_cache, TTL
+from geo import geohash
+from prompt_context import turn_prompt
+from summaries import restaurant_prose
+from maps_function import MAX_WORKERS, find_nearby, attach_reviews, with_origin, without_origin, get_google_reviews, nearest_station_walk, get_place_info
+
+# Process-wide limits shared by every Streamlit session
+LIMITS = {'openai': 16, 'google': MAX_WORKERS}
+# Jobs waiting on the engine at once before new ones are turned away
+MAX_PENDING = 64
+# Seconds an interactive job may queue for a slot, background jobs never queue
+ADMISSION_WAIT = 15
+JOB_TIMEOUT = 90
+
+
+class ServiceBusy(Exception):
+    """Raised when the engine already has MAX_PENDING jobs, so the caller can back off."""
+
+
+# Failures outside the app's control, a turn that hits one can simply be retried
+UPSTREAM_ERRORS = (JobTimeout, requests.RequestException, openai.OpenAIError)
+
+
+class RequestEngine:
+    """
+    One asyncio event loop on a background thread that runs the upstream work of every session.
+
+    OpenAI chat calls are awaited natively, blocking Google and vector store calls run on
+    bounded per-API executors, and semaphores cap how many of each are in flight.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='request-engine', daemon=True)
+        self.thread.start()
+
+        self.executors = {api: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=api) for api, limit in LIMITS.items()}
+        self.limits = asyncio.run_coroutine_threadsafe(self._make_limits(), self.loop).result()
+        self.pending = threading.BoundedSemaphore(MAX_PENDING)
+
+    async def _make_limits(self):
+        return {api: asyncio.Semaphore(limit) for api, limit in LIMITS.items()}
+
+    async def blocking(self, api, func, *args):
+        # Executor threads run in a copy of the task context so the call keeps its priority
+        context = contextvars.copy_context()
+        async with self.limits[api]:
+            return await self.loop.run_in_executor(self.executors[api], context.run, func, *args)
+
+    async def invoke(self, runnable, prompt):
+        async with self.limits['openai']:
+            return await runnable.ainvoke(prompt)
+
+    def submit(self, coro, wait=0):
+        # Returns a concurrent.futures.Future, waiting up to `wait` seconds for a free slot
+        acquired = self.pending.acquire(timeout=wait) if wait else self.pending.acquire(blocking=False)
+        if not acquired:
+            coro.close()
+            raise ServiceBusy()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    def run(self, coro, timeout=JOB_TIMEOUT):
+        # Blocks the calling script thread only, the I/O itself is multiplexed on the engine
+        future = self.submit(coro, wait=ADMISSION_WAIT)
+        try:
+            return future.result(timeout=timeout)
+        except JobTimeout:
+            # Nobody waits for the answer any more, give the slot back
+            future.cancel()
+            raise
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+request_engine = None
+request_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global request_engine
+    with request_engine_lock:
+        if request_engine is None:
+            request_engine = RequestEngine()
+        return request_engine
+
+
+def run(coro, timeout=JOB_TIMEOUT):
+    return get_engine().run(coro, timeout=timeout)
+
+
+def submit(coro, wait=0):
+    return get_engine().submit(coro, wait=wait)
+
+
+async def gather_results(coros):
+    # One {'ok', 'value'|'error'} result per call, in input order, so one failure never hides the others
+    results = []
+    for outcome in await asyncio.gather(*coros, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            print(f"Engine call failed: {outcome!r}")
+            results.append({'ok': False, 'error': repr(outcome)})
+        else:
+            results.append({'ok': True, 'value': outcome})
+    return results
+
+
+async def read_turn(state, input, preference=None, location=None):
+    # Intent, preference, location and number of one message in a single structured call
+    return await get_engine().invoke(get_turn_reader(), turn_prompt(state, input, preference, location))
+
+
+async def get_context(preference, lat=None, lng=None):
+    # The query embedding is an OpenAI call, the search itself is local
+    return await get_engine().blocking('openai', search_context, preference, lat, lng)
+
+
+async def get_distance_and_review(address, context, lat, lng):
+    engine = get_engine()
+    nearby = await engine.blocking('google', find_nearby, address, context, lat, lng)
+    reviews = await gather_results([engine.blocking('google', get_google_reviews, place_id) for _, place_id in nearby])
+    return attach_reviews(nearby, reviews)
+
+
+async def find_restaurants(preference, address, lat, lng):
+    """
+    Enriched candidates for a search, reused from a similar search in the same area when possible.
+
+    A page cache hit costs one query embedding, which is itself cached, and the transit lookups for
+    this exact origin, which are cached per origin and destination.
+    """
+    if lat is None or lng is None:
+        return await get_distance_and_review(address, await get_context(preference, lat, lng), lat, lng)
+
+    cell = geohash(lat, lng)
+    vector = await get_engine().blocking('openai', get_embeddings().embed_query, preference)
+    found, final_li = page_cache.get(cell, vector)
+    if found:
+        # Distances and fares were computed from another origin in the cell, only the candidates are reused
+        return await get_engine().blocking('google', with_origin, address, final_li)
+
+    final_li = await get_distance_and_review(address, await get_context(preference, lat, lng), lat, lng)
+    if final_li:
+        page_cache.set(cell, preference, vector, without_origin(final_li), TTL['page'])
+    return final_li
+
+
+async def generate_recommendations(restaurants):
+    # Prose for every restaurant on a page, None where it could not be written
+    engine = get_engine()
+    model = get_chat_model()
+    results = await gather_results([engine.blocking('openai', restaurant_prose, model, restaurant) for restaurant in restaurants])
+    return [result['value'] if result['ok'] else None for result in results]
+
+
+async def further_info(restaurant_dict):
+    # (nearest station walk, place details), None where a lookup failed
+    engine = get_engine()
+    place_id = restaurant_dict['Place ID']
+    metro, place = await gather_results([
+        engine.blocking('google', nearest_station_walk, place_id, restaurant_dict['Latitude'], restaurant_dict['Longitude'], restaurant_dict['Address']),
+        engine.blocking('google', get_place_info, place_id),
+    ])
+    return metro['value'] if metro['ok'] else None, place['value'] if place['ok'] else None
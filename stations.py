@@ -0,0 +1,78 @@
+import os
+import json
+import math
+from collections import defaultdict
+from functools import lru_cache
+import numpy as np
+
+from geo import haversine_km
+
+# Written by `python precompute.py stations`
+STATION_INDEX_PATH = os.path.join('faiss_db', 'nearest_stations.json')
+
+# Grid cell size in degrees, about 1.1 km north-south and 0.7 km east-west in London
+CELL_DEG = 0.01
+
+
+class StationIndex:
+    """
+    Nearest station of every restaurant, keyed by Place ID, plus a grid over the stations
+    for coordinates that are not in the index.
+    """
+
+    def __init__(self, stations, restaurants, max_km=1.0):
+        self.stations = stations
+        self.restaurants = restaurants
+        self.max_km = max_km
+        self.lats = np.array([station['lat'] for station in stations], dtype=float)
+        self.lngs = np.array([station['lng'] for station in stations], dtype=float)
+
+        self.grid = defaultdict(list)
+        for i, (lat, lng) in enumerate(zip(self.lats, self.lngs)):
+            self.grid[self.cell(lat, lng)].append(i)
+
+    @staticmethod
+    def cell(lat, lng):
+        return math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG)
+
+    def lookup(self, place_id):
+        # (station name, walking distance, walking duration) or None if the restaurant is unknown
+        entry = self.restaurants.get(place_id)
+        if entry is None or entry.get('distance') is None:
+            return None
+        return self.stations[entry['station']]['name'], entry['distance'], entry['duration']
+
+    def nearest(self, lat, lng, max_km=None):
+        # Only the cells that can hold a station within max_km are searched
+        lat, lng = float(lat), float(lng)
+        max_km = self.max_km if max_km is None else max_km
+        rows = math.ceil(max_km / 111.2 / CELL_DEG)
+        cols = math.ceil(max_km / (111.2 * max(math.cos(math.radians(lat)), 0.01)) / CELL_DEG)
+        row, col = self.cell(lat, lng)
+        candidates = [i for r in range(row - rows, row + rows + 1) for c in range(col - cols, col + cols + 1) for i in self.grid.get((r, c), [])]
+        if not candidates:
+            return None
+
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > max_km:
+            return None
+        return self.stations[candidates[best]]
+
+
+def read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+@lru_cache(maxsize=None)
+def load_station_index(path=STATION_INDEX_PATH):
+    # A grid over only the stations Google happened to report can miss the actual nearest one,
+    # so without the precomputed index every station comes from the Places search
+    data = read_json(path, None)
+    if data is None:
+        return StationIndex([], {})
+    return StationIndex(data['stations'], data['restaurants'])
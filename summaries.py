@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from functools import lru_cache
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+
+from cache import prose_cache, TTL
+from prompt_context import build_restaurant_context
+
+# Written by `python precompute.py summaries`
+CRITIC_SUMMARIES_PATH = os.path.join('faiss_db', 'critic_summaries.json')
+
+
+def reviews_hash(reviews):
+    # Changes whenever a critic review is added, edited or removed
+    return hashlib.sha256(json.dumps(reviews, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def summarize_critics(model, name, reviews):
+    system = """
+    You are a polite and professional restaurant reviewer.
+
+    Instructions:
+    - Write a description of the restaurant in the style of a restaurant reviewer, no more than 5 sentences.
+    - Use only the critic reviews provided, do not make assumptions beyond them.
+    - Answer only with the description.
+    """
+
+    # prompt template, format the system message and the critic reviews
+    TEMPLATE = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("system", "Restaurant: {name}\nCritic reviews: {reviews}"),
+        ]
+    )
+    prompt = TEMPLATE.format(name=name, reviews=[review.get('text', '') for review in reviews])
+    return model.invoke(prompt).content.strip()
+
+
+@lru_cache(maxsize=None)
+def load_critic_summaries(path=CRITIC_SUMMARIES_PATH):
+    # Without the sidecar file every description is written live
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def critic_summary(place_id, reviews):
+    # A summary built from different reviews than the store now holds is ignored
+    entry = load_critic_summaries().get(place_id)
+    if entry is None or entry['hash'] != reviews_hash(reviews):
+        return None
+    return entry['description']
+
+
+def prose_prompt(restaurant, include_description=True):
+    if include_description:
+        keys = """
+    - Answer ONLY with a JSON object with the keys "description" and "review_summary".
+    - "description": a description of the restaurant in the style of a restaurant reviewer, no more than 5 sentences, based only on critic_reviews, do not consider google reviews comments."""
+    else:
+        keys = """
+    - Answer ONLY with a JSON object with the key "review_summary"."""
+
+    system = f"""
+    You are a polite and professional restaurant reviewer. You are given the data of one restaurant.
+
+    Instructions:{keys}
+    - "review_summary": a short and concise summarization of the google_reviews, no more than 3 lines, or null if there are no google reviews.
+    - Do not make assumptions beyond the provided data.
+    """
+
+    # prompt template, format the system message and restaurant data
+    TEMPLATE = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("system", "Here are the restaurant data: {restaurant}"),
+        ]
+    )
+    exclude = () if include_description else ('critic_reviews',)
+    return TEMPLATE.format(restaurant=build_restaurant_context([restaurant], budget=1200, exclude=exclude))
+
+
+def prose_request(restaurant):
+    """
+    What is still needed to write a restaurant's prose: (prose, prompt, description).
+
+    prose is set when no LLM call is needed, otherwise prompt asks for the missing keys and
+    description holds the offline critic summary, if there is one.
+    """
+    restaurant_dict = restaurant[next(iter(restaurant))]
+    place_id = restaurant_dict['Place ID']
+    found, prose = prose_cache.get('prose', place_id)
+    if found:
+        return prose, None, None
+
+    # Critic descriptions are built offline, only the Google reviews may still need the LLM
+    description = critic_summary(place_id, restaurant_dict.get('Reviews', []))
+    has_google_reviews = isinstance(restaurant.get('google_reviews'), list) and len(restaurant['google_reviews']) > 0
+    if description is not None and not has_google_reviews:
+        prose = {'description': description, 'review_summary': None}
+        prose_cache.set('prose', place_id, prose, TTL['prose'])
+        return prose, None, None
+    return None, prose_prompt(restaurant, include_description=description is None), description
+
+
+def save_prose(restaurant, prose, description):
+    # The prose only depends on the restaurant, so it is shared by every user and page
+    if description is not None:
+        prose['description'] = description
+    prose_cache.set('prose', restaurant[next(iter(restaurant))]['Place ID'], prose, TTL['prose'])
+    return prose
+
+
+def restaurant_prose(model, restaurant):
+    prose, prompt, description = prose_request(restaurant)
+    if prompt is None:
+        return prose
+
+    response_text = model.bind(response_format={"type": "json_object"}).invoke(prompt).content
+    try:
+        prose = json.loads(response_text)
+    except ValueError:
+        prose = {'description': response_text, 'review_summary': None}
+    return save_prose(restaurant, prose, description)
+
+
+def stream_prose(model, restaurant):
+    """
+    Same prose as restaurant_prose, yielded as partial dicts while the JSON answer is generated.
+
+    The last dict yielded is the complete prose, which is cached like restaurant_prose's.
+    """
+    prose, prompt, description = prose_request(restaurant)
+    if prompt is None:
+        yield prose
+        return
+
+    prose = {}
+    for prose in (model.bind(response_format={"type": "json_object"}) | JsonOutputParser()).stream(prompt):
+        yield {**prose, 'description': description or prose.get('description')}
+    yield save_prose(restaurant, dict(prose), description)
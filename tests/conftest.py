@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# App modules read their file locations and secrets when imported, keep them away from the real ones
+WORKDIR = tempfile.mkdtemp(prefix='restaurant-tests-')
+os.environ.setdefault('RESTAURANT_CACHE_PATH', os.path.join(WORKDIR, 'cache.sqlite'))
+os.environ.setdefault('RESTAURANT_RATE_LIMIT_DIR', os.path.join(WORKDIR, 'ratelimit'))
+os.environ.setdefault('RESTAURANT_HISTORY_PATH', os.path.join(WORKDIR, 'history.sqlite'))
+
+secrets_path = os.path.join(WORKDIR, 'secrets.toml')
+with open(secrets_path, 'w') as f:
+    f.write('OPENAI_API_KEY = "sk-test"\nGOOGLE_API_KEY = "test"\n')
+from streamlit import config
+config.set_option('secrets.files', [secrets_path])
@@ -0,0 +1,95 @@
+import cache
+from cache import TTLCache, SemanticPageCache, cached
+
+
+def test_memory_hit_and_miss(tmp_path):
+    store = TTLCache(path=str(tmp_path / 'cache.sqlite'))
+    assert store.get('geocode', 'soho') == (False, None)
+    store.set('geocode', 'soho', [51.5, -0.13], ttl=60)
+    assert store.get('geocode', 'soho') == (True, [51.5, -0.13])
+    assert store.stats()['geocode'] == {'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+
+
+def test_disk_tier_is_shared(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    TTLCache(path=path).set('geocode', 'soho', [51.5, -0.13], ttl=60)
+    other = TTLCache(path=path)
+    assert other.get('geocode', 'soho') == (True, [51.5, -0.13])
+    assert other.stats()['geocode']['disk_hits'] == 1
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.sqlite')
+    store = TTLCache(path=path)
+    store.set('geocode', 'soho', 1, ttl=10)
+
+    now = cache.time.time()
+    monkeypatch.setattr(cache.time, 'time', lambda: now + 11)
+    assert store.get('geocode', 'soho') == (False, None)
+    assert TTLCache(path=path).get('geocode', 'soho') == (False, None)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    store = TTLCache(path=None, max_entries=2)
+    store.set('ns', 'a', 1, ttl=60)
+    store.set('ns', 'b', 2, ttl=60)
+    store.get('ns', 'a')
+    store.set('ns', 'c', 3, ttl=60)
+    assert store.get('ns', 'b') == (False, None)
+    assert store.get('ns', 'a') == (True, 1)
+    assert store.get('ns', 'c') == (True, 3)
+
+
+def test_cached_skips_failed_results(tmp_path):
+    store = TTLCache(path=str(tmp_path / 'cache.sqlite'))
+    calls = []
+
+    @cached('geocode', cache=store)
+    def lookup(address):
+        calls.append(address)
+        return None if address == 'nowhere' else address.upper()
+
+    assert lookup('soho') == lookup('soho') == 'SOHO'
+    lookup('nowhere')
+    lookup('nowhere')
+    assert calls == ['soho', 'nowhere', 'nowhere']
+
+
+def page_cache(tmp_path, **kwargs):
+    return SemanticPageCache(path=str(tmp_path / 'cache.sqlite'), **kwargs)
+
+
+def test_page_cache_hits_similar_preference_in_same_cell(tmp_path):
+    pages = page_cache(tmp_path, threshold=0.98)
+    pages.set('gcpvj0', 'vegan restaurant', [1.0, 0.0, 0.0], [{'a': 1}], ttl=60)
+    assert pages.get('gcpvj0', [1.0, 0.1, 0.0]) == (True, [{'a': 1}])
+    assert pages.get('gcpvj1', [1.0, 0.0, 0.0]) == (False, None)
+    assert pages.stats() == {'page': {'hits': 1, 'misses': 1}}
+
+
+def test_page_cache_rejects_below_threshold(tmp_path):
+    pages = page_cache(tmp_path, threshold=0.98)
+    pages.set('gcpvj0', 'vegan restaurant', [1.0, 0.0, 0.0], [{'a': 1}], ttl=60)
+    # cosine 0.95, close enough for the old default but a different search
+    assert pages.get('gcpvj0', [0.95, 0.312, 0.0]) == (False, None)
+
+
+def test_page_cache_returns_best_match(tmp_path):
+    pages = page_cache(tmp_path, threshold=0.9)
+    pages.set('gcpvj0', 'vegan', [1.0, 0.0], ['vegan'], ttl=60)
+    pages.set('gcpvj0', 'sushi', [0.0, 1.0], ['sushi'], ttl=60)
+    assert pages.get('gcpvj0', [0.1, 1.0]) == (True, ['sushi'])
+
+
+def test_page_cache_expiry_and_eviction(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+    pages = page_cache(tmp_path, max_entries=2)
+    pages.set('c', 'one', [1.0, 0.0, 0.0], 1, ttl=60)
+    pages.set('c', 'two', [0.0, 1.0, 0.0], 2, ttl=60)
+    pages.set('c', 'three', [0.0, 0.0, 1.0], 3, ttl=60)
+    assert pages.get('c', [1.0, 0.0, 0.0]) == (False, None)
+    assert pages.get('c', [0.0, 0.0, 1.0]) == (True, 3)
+
+    monkeypatch.setattr(cache.time, 'time', lambda: 1100)
+    assert pages.get('c', [0.0, 0.0, 1.0]) == (False, None)
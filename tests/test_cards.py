@@ -0,0 +1,63 @@
+from datetime import date
+
+from cards import render_card
+from prompt_context import project_restaurant, relative_date
+
+
+def context(**fields):
+    restaurant = {
+        'Address': '47 Villiers St, London',
+        'Instagram': '@gordonswinebar',
+        'Reviews': [{'source': 'Evening Standard', 'text': 'Candlelit cellar.'}, {'source': 'Time Out', 'text': 'A classic.'}],
+    }
+    restaurant.update(fields.pop('restaurant', {}))
+    context_dict = {"gordon's wine bar": restaurant, 'distance': '1.2 km', 'duration': '9 mins', 'fare': '£2.80'}
+    context_dict.update(fields)
+    return context_dict
+
+
+def test_project_restaurant_without_google_data():
+    restaurant = project_restaurant(context(fare=None, restaurant={'Instagram': 'None'}))
+    assert restaurant['name'] == "gordon's wine bar" and restaurant['unique_review_sources'] == 2
+    assert restaurant['google_rating'] == 'NA' and restaurant['average_rating_last_five'] == 'NA'
+    assert restaurant['latest_review'] == 'N/A' and restaurant['google_reviews'] == []
+    assert restaurant['fare'] is None and restaurant['instagram'] is None
+
+
+def test_project_restaurant_with_google_reviews():
+    reviews = [{'rating': 5, 'text': 'Great', 'published': '2024-05-01'}, {'rating': 4, 'text': 'Busy', 'published': '2024-06-01'},
+               {'rating': 'NA', 'text': 'No rating', 'published': ''}]
+    restaurant = project_restaurant(context(total_rating=4.6, rating_counts=2100, google_reviews=reviews))
+    assert restaurant['google_rating'] == 4.6 and restaurant['google_rating_count'] == 2100
+    assert restaurant['average_rating_last_five'] == 4.5
+    assert restaurant['google_reviews'] == ['Great', 'Busy', 'No rating']
+    assert restaurant['instagram'] == '@gordonswinebar'
+
+
+def test_relative_date():
+    today = date(2024, 6, 15)
+    assert relative_date('2024-06-15', today) == 'today'
+    assert relative_date('2024-06-01', today) == '2 weeks ago'
+    assert relative_date('2023-06-01', today) == '1 year ago'
+    assert relative_date('', today) == 'N/A'
+
+
+def test_card_keeps_apostrophes_in_the_name():
+    card = render_card(1, context(), {'description': 'A candlelit wine cellar.'})
+    assert card.startswith("# 1. Gordon's Wine Bar\n")
+    assert "From **2** reviews" in card and "_A candlelit wine cellar._" in card
+
+
+def test_card_leaves_out_missing_fields():
+    card = render_card(2, context(fare=None, restaurant={'Instagram': 'None', 'Reviews': [{'source': 'Time Out'}]}), {})
+    assert 'Google rating' not in card and 'Fare' not in card and 'Instagram' not in card
+    assert "From **1** review," in card and 'No description available.' in card
+    assert '- **Distance:** 1.2 km' in card and '- **Address:** 47 Villiers St, London' in card
+
+
+def test_card_with_google_rating():
+    card = render_card(3, context(total_rating=4.6, rating_counts=2100, google_reviews=[{'rating': 4, 'text': 'Busy', 'published': ''}]),
+                       {'description': 'Wine bar.', 'review_summary': 'Loved by regulars'})
+    assert "Overall Google rating is **4.6** stars from **2100** reviews" in card
+    assert "`Loved by regulars (latest review: N/A)`" in card
+    assert '- **Fare:** £2.80' in card and '- **Instagram:** @gordonswinebar' in card
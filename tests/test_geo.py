@@ -0,0 +1,72 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from geo import haversine_km, doc_coordinates, within_radius, hybrid_rank, geohash
+
+SOHO = (51.5136, -0.1365)
+SHOREDITCH = (51.5245, -0.0781)
+
+
+def doc(lat, lng):
+    return Document(page_content='{}', metadata={'latitude': lat, 'longitude': lng})
+
+
+def test_haversine_known_distance():
+    # Soho to Shoreditch is about 4.2 km in a straight line
+    assert abs(haversine_km(*SOHO, [SHOREDITCH[0]], [SHOREDITCH[1]])[0] - 4.2) < 0.1
+
+
+def test_haversine_zero_and_symmetric():
+    assert haversine_km(*SOHO, [SOHO[0]], [SOHO[1]])[0] == 0
+    there = haversine_km(*SOHO, [SHOREDITCH[0]], [SHOREDITCH[1]])[0]
+    back = haversine_km(*SHOREDITCH, [SOHO[0]], [SOHO[1]])[0]
+    assert np.isclose(there, back)
+
+
+def test_doc_coordinates_reads_string_coordinates_from_content():
+    content = Document(page_content='{"Dishoom": {"Latitude": "51.5136", "Longitude": "-0.1365"}}', metadata={})
+    assert doc_coordinates(content) == SOHO
+
+
+def test_doc_coordinates_unknown_is_nan():
+    assert np.isnan(doc_coordinates(Document(page_content='not json', metadata={}))).all()
+
+
+def test_within_radius():
+    mask = within_radius(*SOHO, [doc(*SOHO), doc(*SHOREDITCH), Document(page_content='', metadata={})], radius_km=3)
+    assert mask.tolist() == [True, False, False]
+
+
+def test_within_radius_without_location_keeps_everything():
+    assert within_radius(None, None, [doc(*SOHO), doc(*SHOREDITCH)]).all()
+
+
+def test_hybrid_rank_prefers_closer_doc_on_equal_relevance():
+    near, far = doc(*SOHO), doc(51.5136, -0.1100)
+    ranked = hybrid_rank([(far, 0.8), (near, 0.8)], *SOHO)
+    assert [d for d, _ in ranked] == [near, far]
+
+
+def test_hybrid_rank_drops_docs_outside_radius():
+    ranked = hybrid_rank([(doc(*SHOREDITCH), 0.99), (doc(*SOHO), 0.5)], *SOHO)
+    assert [score for _, score in ranked] == [0.5]
+
+
+def test_hybrid_rank_keeps_order_on_ties():
+    a, b = doc(*SOHO), doc(*SOHO)
+    assert [d for d, _ in hybrid_rank([(a, 0.7), (b, 0.7)], *SOHO)] == [a, b]
+
+
+def test_hybrid_rank_empty():
+    assert hybrid_rank([], *SOHO) == []
+
+
+def test_geohash_reference_value():
+    # Reference point from the geohash specification
+    assert geohash(57.64911, 10.40744, precision=11) == 'u4pruydqqvj'
+
+
+def test_geohash_neighbours_share_cells_by_precision():
+    assert geohash(*SOHO) == geohash(SOHO[0] + 0.001, SOHO[1] + 0.001)
+    assert geohash(*SOHO) != geohash(*SHOREDITCH)
+    assert geohash(*SOHO).startswith(geohash(*SOHO, precision=4))
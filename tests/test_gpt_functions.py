@@ -0,0 +1,77 @@
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+
+import gpt_functions
+from intent import Turn
+
+
+class SessionState(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """Session state of a fresh chat, with the replies and geocoded addresses it produced."""
+    state = SessionState(state='prepare', preference=None, location=None, input='message', memories=[])
+    replies, geocoded = [], []
+
+    def get_geolocation(address):
+        geocoded.append(address)
+        if address == 'nowhere':
+            raise IndexError(address)
+        return 51.5, -0.12
+
+    fake_st = SimpleNamespace(session_state=state, chat_message=lambda role: nullcontext(), write_stream=list)
+    monkeypatch.setattr(gpt_functions, 'st', fake_st)
+    monkeypatch.setattr(gpt_functions, 'off_topic_response', replies.append)
+    monkeypatch.setattr(gpt_functions, 'get_geolocation', get_geolocation)
+    return state, replies, geocoded
+
+
+def test_preference_without_location_asks_for_the_starting_point(session):
+    state, replies, geocoded = session
+    gpt_functions.set_preference(Turn(intent='preference', preference='vegan food'))
+    assert state.state == 'location' and state.preference == 'vegan food'
+    assert state.input is None and 'starting point' in state.memories[-1]['content']
+    assert geocoded == []
+
+
+def test_location_completes_the_search(session):
+    state, replies, geocoded = session
+    state.update(state='location', preference='vegan food')
+    gpt_functions.set_preference(Turn(intent='location', location='soho'))
+    assert state.state == 'generate' and (state.lat, state.lng) == (51.5, -0.12)
+    assert geocoded == ['soho'] and replies == []
+
+
+def test_location_without_preference_asks_for_preference(session):
+    state, replies, geocoded = session
+    gpt_functions.set_preference(Turn(intent='location', location='soho'))
+    assert state.state == 'prepare' and state.location == 'soho'
+    assert replies == ['preference']
+
+
+def test_nothing_new_asks_again_for_what_the_state_waits_for(session):
+    state, replies, geocoded = session
+    state.update(state='location', preference='vegan food')
+    gpt_functions.set_preference(Turn(intent='neither'))
+    assert state.state == 'location' and replies == ['location']
+
+
+def test_unknown_location_is_cleared(session):
+    state, replies, geocoded = session
+    state.update(state='location', preference='vegan food')
+    gpt_functions.set_preference(Turn(intent='location', location='nowhere'))
+    assert state.state == 'location' and state.location is None
+    assert replies == ['location']
+
+
+def test_new_location_keeps_the_preference(session):
+    state, replies, geocoded = session
+    state.update(state='continuation', preference='vegan food', location='soho')
+    gpt_functions.set_preference(Turn(intent='location', location='camden'))
+    assert state.state == 'generate' and state.preference == 'vegan food'
+    assert geocoded == ['camden']
@@ -0,0 +1,93 @@
+import pickle
+import pytest
+
+import history
+from history import History, SessionStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SessionStore(path=str(tmp_path / 'history.sqlite'))
+    monkeypatch.setattr(history, 'session_store', store)
+    return store
+
+
+def messages(count):
+    return [{'role': 'user' if i % 2 else 'assistant', 'content': f'message {i}'} for i in range(count)]
+
+
+def test_window_is_kept_in_memory(store):
+    chat = History(window=4)
+    for message in messages(4):
+        chat.append(message)
+    assert chat.spilled == 0
+    assert list(chat) == messages(4)
+
+
+def test_overflow_spills_down_to_half_the_window(store):
+    chat = History(window=4)
+    for message in messages(5):
+        chat.append(message)
+    assert chat.spilled == 3
+    assert list(chat) == messages(5)[3:]
+    assert len(chat) == 5
+
+
+def test_spilled_messages_read_back_in_order(store):
+    chat = History(window=4)
+    for message in messages(11):
+        chat.append(message)
+    assert chat.earlier() + list(chat) == messages(11)
+    assert chat.earlier(limit=2) == messages(11)[chat.spilled - 2:chat.spilled]
+
+
+def test_memory_stays_bounded(store):
+    chat = History(window=4)
+    for message in messages(200):
+        chat.append(message)
+    assert len(list(chat)) <= 4
+    assert len(pickle.dumps(chat)) < 1024
+
+
+def test_sessions_are_separate(store):
+    first, second = History(window=2), History(window=2)
+    for message in messages(3):
+        first.append(message)
+    assert first.earlier() and second.earlier() == []
+
+
+def test_store_keeps_at_most_max_spilled(tmp_path):
+    store = SessionStore(path=str(tmp_path / 'history.sqlite'), max_spilled=3)
+    store.spill('s', 0, messages(5))
+    assert store.load('s', 0, 5) == messages(5)[2:]
+
+
+def test_store_drops_expired_sessions(tmp_path, monkeypatch):
+    store = SessionStore(path=str(tmp_path / 'history.sqlite'), ttl=10)
+    store.spill('old', 0, messages(2))
+    now = history.time.time()
+    monkeypatch.setattr(history.time, 'time', lambda: now + 11)
+    store.spill('new', 0, messages(1))
+    assert store.load('old', 0, 2) == []
+    assert store.load('new', 0, 1) == messages(1)
+
+
+def test_embeds_survive_the_round_trip(store):
+    chat = History(window=2)
+    page = {'role': 'assistant', 'content': 'cards', 'embeds': ['https://www.instagram.com/dishoom/embed/']}
+    for message in [page] + messages(3):
+        chat.append(message)
+    assert chat.earlier()[0] == page
+
+
+def test_stored_counts_only_what_the_store_still_holds(store, monkeypatch):
+    store.max_spilled = 5
+    chat = History(window=4)
+    assert chat.stored() == 0
+    for message in messages(20):
+        chat.append(message)
+    assert chat.spilled > 5 and chat.stored() == len(chat.earlier()) == 5
+
+    now = history.time.time()
+    monkeypatch.setattr(history.time, 'time', lambda: now + history.HISTORY_TTL + 1)
+    assert chat.stored() == 0 and chat.earlier() == []
@@ -0,0 +1,42 @@
+import pytest
+
+import intent
+from intent import classify_rules, classify_response, turn_from_label
+
+
+@pytest.mark.parametrize('text', ['yes', 'Yes!', 'more', 'show me more options', 'other restaurants', 'sure, go ahead', 'next ones'])
+def test_other(text):
+    assert classify_rules(text)[0] == 'other'
+
+
+@pytest.mark.parametrize('text', ['change preferences', 'I want to change my preferences', 'new search', 'start over'])
+def test_preference(text):
+    assert classify_rules(text)[0] == 'preference'
+
+
+@pytest.mark.parametrize('text, number', [('2', '2'), ('number 3', '3'), ('#1', '1'), ('tell me about the second one', '2'), ('option two', '2'),
+                                          ('tell me about 3', '3'), ('what about # 1', '1')])
+def test_number(text, number):
+    assert classify_rules(text)[0] == number
+
+
+@pytest.mark.parametrize('text', ['', 'what about the weather', 'compare 1 and 2', 'change number 2 to vegan food',
+                                  'italian food for 2', 'somewhere for 4 people', 'show me 3 more', '1 more please',
+                                  '0', 'number 7', '12', 'change location to soho', 'switch to a different cuisine',
+                                  'new search for vegan food'])
+def test_unclear_replies_are_left_to_the_llm(text):
+    assert classify_rules(text)[1] < intent.CONFIDENCE_THRESHOLD
+
+
+def test_classify_response_records_source(monkeypatch):
+    monkeypatch.setattr(intent, 'metrics', intent.Counter())
+    assert classify_response('more') == 'other'
+    assert classify_response('what about the weather') is None
+    assert intent.metrics == {'rules': 1, 'llm': 1}
+    assert intent.fallback_rate() == 0.5
+
+
+def test_turn_from_label():
+    assert turn_from_label('3').intent == 'number' and turn_from_label('3').number == 3
+    assert turn_from_label('other').intent == 'other'
+    assert turn_from_label('preference').preference is None
@@ -0,0 +1,116 @@
+import json
+import pytest
+import requests
+
+import utils
+import maps_function
+
+
+def reply(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode('utf-8')
+    response.url = 'https://places.googleapis.com/v1/places/test'
+    return response
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Queue of responses for the shared Google session, the last one repeats."""
+    calls, replies = [], []
+
+    def request(method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    monkeypatch.setattr(maps_function.session, 'request', request)
+    monkeypatch.setattr(utils.time, 'sleep', lambda seconds: None)
+    return calls, replies
+
+
+def test_client_errors_raise_without_retry_and_are_not_cached(upstream):
+    calls, replies = upstream
+    replies.append(reply(403, {'error': {'code': 403, 'status': 'PERMISSION_DENIED'}}))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            maps_function.get_place_info('place-forbidden')
+    assert len(calls) == 2
+
+
+def test_throttling_is_retried(upstream):
+    calls, replies = upstream
+    replies += [reply(429, {}), reply(503, {}), reply(200, {'displayName': {'text': 'Dishoom'}})]
+    assert maps_function.get_place_info('place-throttled')['restaurant'] == 'Dishoom'
+    assert len(calls) == 3
+
+
+def test_successful_lookups_are_cached(upstream):
+    calls, replies = upstream
+    replies.append(reply(200, {'displayName': {'text': 'Dishoom'}}))
+    maps_function.get_place_info('place-ok')
+    maps_function.get_place_info('place-ok')
+    assert len(calls) == 1
+
+
+def test_place_without_reviews_is_cached_as_empty(upstream):
+    calls, replies = upstream
+    replies.append(reply(200, {}))
+    assert maps_function.get_google_reviews('place-quiet') == ('NA', 0, [])
+    assert maps_function.get_google_reviews('place-quiet') == ('NA', 0, [])
+    assert len(calls) == 1
+
+
+def test_reviews_error_body_raises_and_is_not_cached(upstream):
+    calls, replies = upstream
+    replies.append(reply(403, {'error': {'code': 403, 'status': 'PERMISSION_DENIED'}}))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            maps_function.get_google_reviews('place-denied')
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def matrix(monkeypatch):
+    """Fake Distance Matrix, an OK element per requested destination unless a row is queued."""
+    calls, rows = [], []
+
+    def request_json(method, url, params=None, **kwargs):
+        destinations = params['destinations'].split('|')
+        calls.append(destinations)
+        if rows:
+            return {'rows': [{'elements': rows.pop(0)}]}
+        return {'rows': [{'elements': [{'status': 'OK', 'duration': {'text': d}} for d in destinations]}]}
+
+    monkeypatch.setattr(maps_function, 'request_json', request_json)
+    return calls, rows
+
+
+def test_transit_distances_are_requested_in_chunks(matrix):
+    calls, rows = matrix
+    destinations = [f"place {i}" for i in range(30)]
+    elements = maps_function.get_transit_distances('origin chunks', destinations)
+    assert [len(chunk) for chunk in calls] == [25, 5]
+    assert [element['duration']['text'] for element in elements] == destinations
+
+
+def test_cached_pairs_are_not_requested_again(matrix):
+    calls, rows = matrix
+    maps_function.get_transit_distances('origin cached', ['a', 'b'])
+    elements = maps_function.get_transit_distances('origin cached', ['a', 'c', 'b'])
+    assert calls == [['a', 'b'], ['c']]
+    assert [element['duration']['text'] for element in elements] == ['a', 'c', 'b']
+
+
+def test_short_row_leaves_empty_elements(matrix):
+    calls, rows = matrix
+    rows.append([{'status': 'OK', 'duration': {'text': 'a'}}])
+    assert maps_function.get_transit_distances('origin short', ['a', 'b', 'c']) == [{'status': 'OK', 'duration': {'text': 'a'}}, {}, {}]
+
+
+def test_only_ok_elements_are_cached(matrix):
+    calls, rows = matrix
+    rows.append([{'status': 'ZERO_RESULTS'}, {'status': 'OK', 'duration': {'text': 'b'}}])
+    maps_function.get_transit_distances('origin status', ['a', 'b'])
+    elements = maps_function.get_transit_distances('origin status', ['a', 'b'])
+    assert calls == [['a', 'b'], ['a']]
+    assert elements[0]['status'] == 'OK' and elements[1]['duration']['text'] == 'b'
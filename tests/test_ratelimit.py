@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from ratelimit import TokenBucket, background
+
+
+def test_burst_then_refill(tmp_path):
+    bucket = TokenBucket('test', rate=10, capacity=3, directory=str(tmp_path))
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.1
+
+
+def test_blocking_acquire_keeps_the_rate(tmp_path):
+    bucket = TokenBucket('test', rate=20, capacity=2, directory=str(tmp_path))
+    start = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    # Two from the burst, four at 20 per second
+    assert 0.15 <= time.perf_counter() - start < 1
+
+
+def test_non_blocking_acquire(tmp_path):
+    bucket = TokenBucket('test', rate=1, capacity=1, directory=str(tmp_path))
+    assert bucket.acquire(blocking=False) is True
+    assert bucket.acquire(blocking=False) is False
+
+
+def test_buckets_share_state_through_the_file(tmp_path):
+    first = TokenBucket('shared', rate=1, capacity=2, directory=str(tmp_path))
+    second = TokenBucket('shared', rate=1, capacity=2, directory=str(tmp_path))
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == 0
+    assert first.try_acquire() > 0
+
+
+def test_background_work_leaves_a_reserve(tmp_path):
+    bucket = TokenBucket('test', rate=1, capacity=4, directory=str(tmp_path))
+
+    async def take():
+        return bucket.try_acquire(bucket.reserve())
+
+    # Background calls stop at half the bucket, interactive ones may use the rest
+    assert [asyncio.run(background(take())) for _ in range(2)] == [0, 0]
+    assert asyncio.run(background(take())) > 0
+    assert bucket.try_acquire() == 0
+
+
+def test_aacquire_does_not_block_the_loop(tmp_path):
+    bucket = TokenBucket('test', rate=20, capacity=1, directory=str(tmp_path))
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.gather(*[bucket.aacquire() for _ in range(5)])
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
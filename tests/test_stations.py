@@ -0,0 +1,65 @@
+import json
+import math
+
+import pytest
+
+from geo import haversine_km
+from stations import StationIndex, load_station_index
+
+
+def east(lat, lng, km):
+    # Longitude of the point km east of (lat, lng)
+    return lng + km / (111.2 * math.cos(math.radians(lat)))
+
+
+def station(name, lat, lng):
+    return {'name': name, 'address': f"{name} Station", 'lat': lat, 'lng': lng}
+
+
+def test_nearest_searches_every_cell_within_max_km():
+    # 0.9 km east of central London is more than one 0.01 degree cell away
+    lat, lng = 51.5, -0.12
+    index = StationIndex([station('East', lat, east(lat, lng, 0.9))], {})
+    assert index.nearest(lat, lng)['name'] == 'East'
+    assert index.nearest(lat, lng, max_km=0.5) is None
+
+
+@pytest.mark.parametrize('lat', [0.0, 51.5, 80.0])
+def test_longitude_cells_widen_with_latitude(lat):
+    # A degree of longitude shrinks towards the poles, so more columns are searched
+    lng = 10.005
+    index = StationIndex([station('East', lat, east(lat, lng, 0.95)), station('Far', lat, east(lat, lng, 1.2))], {})
+    assert index.nearest(lat, lng)['name'] == 'East'
+    assert abs(haversine_km(lat, lng, lat, east(lat, lng, 0.95)) - 0.95) < 0.01
+
+
+def test_nearest_picks_the_closest_station_across_a_cell_border():
+    # The point is in the upper half of its cell, the closer station is in the cell above
+    same_cell = station('Same cell', 51.5001, -0.1195)
+    next_cell = station('Next cell', 51.5101, -0.1195)
+    index = StationIndex([same_cell, next_cell], {})
+    assert index.cell(51.5060, -0.1195) == index.cell(same_cell['lat'], same_cell['lng'])
+    assert index.nearest(51.5060, -0.1195)['name'] == 'Next cell'
+
+
+def test_nearest_casts_string_coordinates():
+    index = StationIndex([station('Bank', 51.5133, -0.0886)], {})
+    assert index.nearest('51.5134', '-0.0887')['name'] == 'Bank'
+
+
+def test_lookup():
+    index = StationIndex([station('Bank', 51.5133, -0.0886)], {
+        'place-a': {'station': 0, 'distance': '0.3 km', 'duration': '4 mins'},
+        'place-b': {'station': 0, 'distance': None, 'duration': None},
+    })
+    assert index.lookup('place-a') == ('Bank', '0.3 km', '4 mins')
+    assert index.lookup('place-b') is None and index.lookup('place-c') is None
+
+
+def test_missing_index_has_no_stations(tmp_path):
+    index = load_station_index(str(tmp_path / 'missing.json'))
+    assert index.nearest(51.5, -0.12) is None and index.lookup('place-a') is None
+
+    path = tmp_path / 'nearest_stations.json'
+    path.write_text(json.dumps({'stations': [station('Bank', 51.5133, -0.0886)], 'restaurants': {}}))
+    assert load_station_index(str(path)).nearest(51.5134, -0.0887)['name'] == 'Bank'
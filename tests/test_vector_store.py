@@ -0,0 +1,73 @@
+import math
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from vector_store import MmapVectorStore, write_store
+
+
+class FixedEmbeddings(Embeddings):
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text].tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+VECTORS = [unit(1, 0, 0), unit(0, 1, 0), unit(1, 1, 0)]
+DOCS = [Document(page_content=f'{{"doc {i}": {{}}}}', metadata={'row': i}) for i in range(3)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    write_store(str(tmp_path), VECTORS, DOCS)
+    store = MmapVectorStore(str(tmp_path), FixedEmbeddings({'x': unit(1, 0, 0), 'diagonal': unit(1, 1, 0)}))
+    yield store
+    store.close()
+
+
+def test_exists(tmp_path, store):
+    assert MmapVectorStore.exists(store.path)
+    assert not MmapVectorStore.exists(str(tmp_path / 'missing'))
+
+
+def test_results_are_ordered_and_round_trip_documents(store):
+    results = store.similarity_search_with_relevance_scores('x', k=3)
+    assert [doc.metadata['row'] for doc, _ in results] == [0, 2, 1]
+    assert results[0][0].page_content == DOCS[0].page_content
+
+
+def test_relevance_scores_match_langchain_euclidean(store):
+    # FAISS relevance for unit vectors: 1 - squared L2 distance / sqrt(2)
+    scores = {doc.metadata['row']: score for doc, score in store.similarity_search_with_relevance_scores('x', k=3)}
+    assert scores[0] == pytest.approx(1.0)
+    assert scores[1] == pytest.approx(1 - 2 / math.sqrt(2))
+    assert scores[2] == pytest.approx(1 - (2 - math.sqrt(2)) / math.sqrt(2))
+
+
+def test_k_larger_than_store(store):
+    assert len(store.similarity_search_with_relevance_scores('diagonal', k=10)) == 3
+
+
+def test_same_scores_as_faiss(store):
+    faiss = pytest.importorskip('faiss')
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    index = faiss.IndexFlatL2(3)
+    index.add(np.stack(VECTORS))
+    reference = FAISS(store.embeddings, index, InMemoryDocstore({str(i): doc for i, doc in enumerate(DOCS)}), {i: str(i) for i in range(3)})
+
+    expected = reference.similarity_search_with_relevance_scores('diagonal', k=3)
+    actual = store.similarity_search_with_relevance_scores('diagonal', k=3)
+    assert [doc.metadata['row'] for doc, _ in actual] == [doc.metadata['row'] for doc, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected], abs=1e-6)
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+
+from cache import maps_cache, prose_cache, search_cache, page_cache
+from intent import metrics as intent_metrics, metrics_lock as intent_metrics_lock
+
+# Set RESTAURANT_TRACE_PATH to append one JSON line per turn
+TRACE_PATH = os.environ.get('RESTAURANT_TRACE_PATH')
+# Set RESTAURANT_METRICS_PORT to serve Prometheus text on http://127.0.0.1:<port>/metrics
+METRICS_PORT = os.environ.get('RESTAURANT_METRICS_PORT')
+# Set RESTAURANT_DEBUG_PANEL=1, or open the app with ?debug=1, to show the waterfall in the sidebar
+DEBUG_PANEL = os.environ.get('RESTAURANT_DEBUG_PANEL') == '1'
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+current_span = contextvars.ContextVar('current_span', default=None)
+
+# Process-wide totals, exported as Prometheus counters
+metrics_lock = threading.Lock()
+upstream_calls = Counter()
+token_usage = Counter()
+span_seconds = defaultdict(lambda: [0, 0.0])
+
+caches = {'maps': maps_cache, 'prose': prose_cache, 'search': search_cache, 'page': page_cache}
+
+
+class Trace:
+    """
+    Spans, upstream calls and token usage of one script run.
+
+    Work started during the turn carries the trace with it into the request engine,
+    spans that finish after the turn has been closed are only counted in the totals.
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.upstream_calls = Counter()
+        self.tokens = Counter()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            if not self.closed:
+                self.spans.append(span)
+
+    def count(self, counter, key, amount=1):
+        with self.lock:
+            if not self.closed:
+                counter[key] += amount
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'name': self.name,
+                'started': self.started,
+                'spans': sorted(self.spans, key=lambda span: span['start']),
+                'upstream_calls': dict(self.upstream_calls),
+                'tokens': dict(self.tokens),
+            }
+
+
+@contextmanager
+def span(name, **attrs):
+    trace = current_trace.get()
+    parent = current_span.get()
+    span_id = uuid.uuid4().hex[:12]
+    token = current_span.set(span_id)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        # A generator closed by the garbage collector finishes in another context
+        try:
+            current_span.reset(token)
+        except ValueError:
+            pass
+        duration = time.perf_counter() - start
+        with metrics_lock:
+            span_seconds[name][0] += 1
+            span_seconds[name][1] += duration
+        if trace is not None:
+            trace.add({
+                'id': span_id,
+                'parent': parent,
+                'name': name,
+                'start': start - trace.origin,
+                'duration': duration,
+                'thread': threading.current_thread().name,
+                'error': error,
+                **attrs,
+            })
+
+
+def traced(name=None):
+    """
+    Decorator that records a span for every call of a function, coroutine or generator.
+
+    Generators are timed until they are exhausted, so streamed answers include the streaming.
+    """
+    def decorator(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(label):
+                    yield from func(*args, **kwargs)
+        elif inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(label):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(label):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_upstream(api):
+    with metrics_lock:
+        upstream_calls[api] += 1
+    trace = current_trace.get()
+    if trace is not None:
+        trace.count(trace.upstream_calls, api)
+
+
+def record_tokens(model, input_tokens, output_tokens):
+    with metrics_lock:
+        token_usage[(model, 'input')] += input_tokens
+        token_usage[(model, 'output')] += output_tokens
+    trace = current_trace.get()
+    if trace is not None:
+        trace.count(trace.tokens, 'input', input_tokens)
+        trace.count(trace.tokens, 'output', output_tokens)
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Counts chat model calls and their token usage, attach it with ChatOpenAI(callbacks=[...])."""
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        record_upstream('openai_chat')
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                usage = getattr(message, 'usage_metadata', None)
+                if usage:
+                    model = message.response_metadata.get('model_name', 'openai')
+                    record_tokens(model, usage.get('input_tokens', 0), usage.get('output_tokens', 0))
+
+
+usage_callback = UsageCallback()
+
+
+def register_cache(name, cache):
+    caches[name] = cache
+
+
+def export(trace):
+    if not TRACE_PATH:
+        return
+    try:
+        with open(TRACE_PATH, 'a') as f:
+            f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+    except OSError as e:
+        print(f"Trace export failed: {e}")
+
+
+@contextmanager
+def turn(name='turn'):
+    # Traces one Streamlit script run, everything called from it becomes a child span
+    trace = Trace(name)
+    token = current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        current_trace.reset(token)
+        trace.close()
+        export(trace)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in values.items()) + "}"
+
+
+def prometheus_text():
+    lines = []
+    with metrics_lock:
+        lines += ["# HELP restaurant_upstream_calls_total Requests sent to upstream APIs.", "# TYPE restaurant_upstream_calls_total counter"]
+        lines += [f"restaurant_upstream_calls_total{labels(api=api)} {count}" for api, count in sorted(upstream_calls.items())]
+
+        lines += ["# HELP restaurant_llm_tokens_total Tokens reported by the chat model.", "# TYPE restaurant_llm_tokens_total counter"]
+        lines += [f"restaurant_llm_tokens_total{labels(model=model, kind=kind)} {count}" for (model, kind), count in sorted(token_usage.items())]
+
+        lines += ["# HELP restaurant_span_seconds Time spent in traced functions.", "# TYPE restaurant_span_seconds summary"]
+        for name, (count, total) in sorted(span_seconds.items()):
+            lines.append(f"restaurant_span_seconds_count{labels(name=name)} {count}")
+            lines.append(f"restaurant_span_seconds_sum{labels(name=name)} {total:.6f}")
+
+    lines += ["# HELP restaurant_cache_events_total Cache lookups by tier and outcome.", "# TYPE restaurant_cache_events_total counter"]
+    for cache_name, cache in sorted(caches.items()):
+        for namespace, counts in sorted(cache.stats().items()):
+            for event, count in sorted(counts.items()):
+                lines.append(f"restaurant_cache_events_total{labels(cache=cache_name, namespace=namespace, event=event)} {count}")
+
+    lines += ["# HELP restaurant_intent_total Replies to recommendations by classifier.", "# TYPE restaurant_intent_total counter"]
+    with intent_metrics_lock:
+        lines += [f"restaurant_intent_total{labels(source=source)} {count}" for source, count in sorted(intent_metrics.items())]
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics_server = None
+metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    # One endpoint per process, a second worker on the same port just runs without one
+    global metrics_server
+    if not port:
+        return None
+    with metrics_server_lock:
+        if metrics_server is None:
+            try:
+                metrics_server = ThreadingHTTPServer(('127.0.0.1', int(port)), MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint not started: {e}")
+                return None
+            threading.Thread(target=metrics_server.serve_forever, name='metrics', daemon=True).start()
+        return metrics_server
+
+
+def debug_panel_enabled():
+    return DEBUG_PANEL or st.query_params.get('debug') == '1'
+
+
+def waterfall_rows(trace):
+    spans = trace.to_dict()['spans']
+    parents = {span['id']: span['parent'] for span in spans}
+
+    def depth(span_id):
+        level = 0
+        while parents.get(span_id) is not None:
+            span_id = parents[span_id]
+            level += 1
+        return level
+
+    return [{
+        'span': f"{index:02d} {'  ' * depth(span['id'])}{span['name'].split('.')[-1]}",
+        'name': span['name'],
+        'start_ms': round(span['start'] * 1000, 1),
+        'end_ms': round((span['start'] + span['duration']) * 1000, 1),
+        'duration_ms': round(span['duration'] * 1000, 1),
+        'thread': span['thread'],
+    } for index, span in enumerate(spans)]
+
+
+def render_debug_panel(trace):
+    import altair as alt
+    import pandas as pd
+
+    rows = waterfall_rows(trace)
+    with st.sidebar:
+        st.subheader('Turn trace')
+        if not rows:
+            st.caption('Nothing was traced in this turn.')
+            return
+        st.caption(f"Upstream calls: {dict(trace.upstream_calls) or 0} · Tokens: {dict(trace.tokens) or 0}")
+        chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+            x=alt.X('start_ms:Q', title='ms'),
+            x2='end_ms:Q',
+            y=alt.Y('span:N', sort=None, title=None),
+            color=alt.Color('thread:N', legend=None),
+            tooltip=['name', 'duration_ms', 'thread'],
+        )
+        st.altair_chart(chart, use_container_width=True)
@@ -1,23 +1,112 @@
+import os
 import time
+import json
+import random
+from email.utils import parsedate_to_datetime
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 import streamlit as st
 from functools import wraps
 
-# Vector DB
-embeddings = OpenAIEmbeddings()
-faiss_db = FAISS.load_local("faiss_db", embeddings, allow_dangerous_deserialization=True)
+from geo import hybrid_rank
+from cache import CachedEmbeddings, search_cache, normalize_query, TTL
+from vector_store import MmapVectorStore
+from ratelimit import get_bucket, SharedRateLimiter
+from tracing import traced, record_upstream, register_cache, usage_callback
+from intent import Turn
 
+# Written by `python precompute.py export`
+INDEX_PATH = os.environ.get('RESTAURANT_INDEX_PATH', 'restaurant_index')
+
+
+def embedding_request():
+    # Runs before every query embedding that missed the cache
+    get_bucket('openai').acquire()
+    record_upstream('openai_embedding')
+
+
+# Shared resources, built once per process on first use and reused by every session
+@st.cache_resource(show_spinner=False)
+def get_embeddings():
+    embeddings = CachedEmbeddings(OpenAIEmbeddings(), rate_limit=embedding_request)
+    register_cache('embedding', embeddings.cache)
+    return embeddings
+
+
+@st.cache_resource(show_spinner=False)
+def get_vector_store():
+    # Prefer the memory-mapped export and fall back to the pickled FAISS store
+    if MmapVectorStore.exists(INDEX_PATH):
+        return MmapVectorStore(INDEX_PATH, get_embeddings())
+    return FAISS.load_local("faiss_db", get_embeddings(), allow_dangerous_deserialization=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_model(model="gpt-4o"):
+    # One client per model keeps its HTTP connection pool alive between turns,
+    # and every call draws from the OpenAI budget shared by all worker processes
+    return ChatOpenAI(model=model, rate_limiter=SharedRateLimiter(get_bucket('openai')), stream_usage=True, callbacks=[usage_callback])
+
+
+@st.cache_resource(show_spinner=False)
+def get_turn_reader():
+    # Chat model bound to the Turn schema, answers with typed fields instead of free text
+    return get_chat_model().with_structured_output(Turn)
+
+
+@traced()
+def warm_up():
+    get_vector_store()
+    get_chat_model()
+
+
+def teardown():
+    # The turn reader wraps the chat model, it is rebuilt along with it
+    for resource in (get_chat_model, get_turn_reader, get_vector_store, get_embeddings):
+        resource.clear()
+
+@traced()
 def stream_data(response):
     for word in response.split(" "):
         yield word + " "
         time.sleep(0.04)
 
-def get_context(preference):
-    # print(preference)
-    docs_faiss = faiss_db.similarity_search_with_relevance_scores(preference, k=15)
-    return docs_faiss
+def render_message(memory, embeds=True):
+    # Replays a message from the history, recommendation pages keep their Instagram embeds
+    with st.chat_message(memory["role"]):
+        st.write(memory["content"])
+        for embed in memory.get("embeds", ()) if embeds else ():
+            st.components.v1.iframe(embed, height=380, scrolling=True)
+
+
+@traced()
+def stream_tokens(model, prompt):
+    # Yield the completion as it is generated instead of waiting for the whole answer
+    for chunk in model.stream(prompt):
+        if chunk.content:
+            yield chunk.content
+
+
+@traced()
+def get_context(preference, lat=None, lng=None, k=15, fetch_k=60):
+    # A repeated search in the same place costs one lookup
+    key = json.dumps([normalize_query(preference), lat, lng, k, fetch_k])
+    found, docs_faiss = search_cache.get('search', key)
+    if found:
+        return list(docs_faiss)
 
+    # Without a location only the vector similarity can rank the restaurants
+    if lat is None or lng is None:
+        docs_faiss = get_vector_store().similarity_search_with_relevance_scores(preference, k=k)
+    else:
+        # Over-fetch, then keep the best mix of relevance and distance to the user
+        docs_faiss = get_vector_store().similarity_search_with_relevance_scores(preference, k=fetch_k)
+        docs_faiss = hybrid_rank(docs_faiss, lat, lng)[:k]
+
+    search_cache.set('search', key, docs_faiss, TTL['search'])
+    return list(docs_faiss)
+
+@traced()
 def off_topic_response(topic):
     # Define response messages and states for each topic
     responses = {
@@ -36,6 +125,10 @@ def off_topic_response(topic):
         'out of range': {
             "answer": "\nPlease pick a number from the restaurants listed above.",
             "state": 'continuation'
+        },
+        'busy': {
+            "answer": "\nSorry, I'm helping a lot of people right now. Please send your message again in a moment.",
+            "state": None
         }
     }
 
@@ -44,19 +137,40 @@ def off_topic_response(topic):
     if response_data:
         answer = response_data["answer"]
         st.session_state.memories.append({"role": "assistant", "content": answer})
-        st.session_state.state = response_data["state"]
+        if response_data["state"] is not None:
+            st.session_state.state = response_data["state"]
 
         with st.chat_message("assistant"):
             st.write_stream(stream_data(answer))
 
 
-def retry_on_failure(retries=5, delay=1):
+def retry_after(exception):
+    # Seconds the server asked us to wait, from the Retry-After header of a requests or OpenAI error
+    response = getattr(exception, 'response', None)
+    value = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_on_failure(retries=5, delay=1, max_delay=30, retry_if=None):
     """
     Decorator that retries a function call up to a specified number of times if it fails.
+
+    Waits follow a jittered exponential backoff, unless the server sent a Retry-After header.
     
     Parameters:
         retries (int): The number of retry attempts. Default is 5.
-        delay (int): Delay (in seconds) between retry attempts. Default is 1 second.
+        delay (int): Base delay (in seconds) for the backoff. Default is 1 second.
+        max_delay (int): Upper bound (in seconds) for a single wait. Default is 30 seconds.
+        retry_if (callable): Called with the exception, a false result raises it straight away. Default retries everything.
     """
     def decorator(func):
         @wraps(func)
@@ -69,8 +183,14 @@ def retry_on_failure(retries=5, delay=1):
                 except Exception as e:
                     last_exception = e
                     print(f"Attempt {attempt + 1} failed: {e}")
-                    time.sleep(delay)  # Wait before retrying
+                    if attempt + 1 == retries or (retry_if is not None and not retry_if(e)):
+                        break
+                    # Full jitter keeps sessions that failed together from retrying together
+                    wait = retry_after(e)
+                    if wait is None:
+                        wait = random.uniform(0, delay * 2 ** attempt)
+                    time.sleep(min(wait, max_delay))
             # Raise the last exception if all retries failed
             raise last_exception
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,95 @@
+import os
+import json
+import math
+import numpy as np
+from langchain_core.documents import Document
+
+# Files written by export_store / read by MmapVectorStore
+MANIFEST = 'manifest.json'
+VECTORS = 'vectors.npy'
+NORMS = 'norms.npy'
+DOCUMENTS = 'documents.jsonl'
+OFFSETS = 'offsets.npy'
+
+
+def write_store(path, vectors, documents):
+    """
+    Writes vectors and their documents as plain files: a float32 .npy matrix that can be
+    memory-mapped and an offset-indexed JSONL file with one document per row.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    np.save(os.path.join(path, VECTORS), vectors)
+    np.save(os.path.join(path, NORMS), np.einsum('ij,ij->i', vectors, vectors))
+
+    # Byte offset of every row, plus the end of the file, so a row can be read without parsing the rest
+    offsets = [0]
+    with open(os.path.join(path, DOCUMENTS), 'wb') as f:
+        for doc in documents:
+            line = json.dumps({'page_content': doc.page_content, 'metadata': doc.metadata}, ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(path, OFFSETS), np.array(offsets, dtype=np.int64))
+
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump({'count': len(vectors), 'dimension': int(vectors.shape[1]), 'distance': 'euclidean'}, f)
+
+
+def export_store(faiss_db, path):
+    # Rows keep the FAISS order, so row i is the document of vector i
+    count = faiss_db.index.ntotal
+    vectors = faiss_db.index.reconstruct_n(0, count)
+    documents = (faiss_db.docstore.search(faiss_db.index_to_docstore_id[i]) for i in range(count))
+    write_store(path, vectors, documents)
+
+
+class MmapVectorStore:
+    """
+    Read-only vector store over the files written by export_store.
+
+    Vectors are memory-mapped so the pages are shared by every process on the host, and
+    documents are only decoded for the rows a search returns.
+    """
+
+    def __init__(self, path, embeddings):
+        self.path = path
+        self.embeddings = embeddings
+        self.vectors = np.load(os.path.join(path, VECTORS), mmap_mode='r')
+        self.norms = np.load(os.path.join(path, NORMS), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, OFFSETS), mmap_mode='r')
+        self.fd = os.open(os.path.join(path, DOCUMENTS), os.O_RDONLY)
+
+    def close(self):
+        if getattr(self, 'fd', None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    def get_document(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        # pread keeps no file position, so concurrent sessions can share the descriptor
+        row = json.loads(os.pread(self.fd, end - start, start))
+        return Document(page_content=row['page_content'], metadata=row['metadata'])
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4):
+        query = np.asarray(embedding, dtype=np.float32)
+
+        # Squared L2 distance, the same metric as the exported IndexFlatL2
+        distances = self.norms - 2 * (self.vectors @ query) + query @ query
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        # Equal distances are ordered by row, as IndexFlatL2 does
+        top = top[np.lexsort((top, distances[top]))]
+
+        # Same relevance function LangChain's FAISS store applies to euclidean distances
+        return [(self.get_document(i), 1.0 - float(distances[i]) / math.sqrt(2)) for i in top]
+
+    def similarity_search_with_relevance_scores(self, query, k=4):
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k=k)